@@ -1,5 +1,7 @@
 import os
 from pathlib import Path
+from typing import Optional
+from sqlalchemy.engine import make_url
 
 __version__ = "0.4.1"
 __author__ = "Charlie Bushman"
@@ -12,3 +14,36 @@ def get_db_last_sync():
             return fp.read_text().strip()
 
     return "Unknown"
+
+
+def get_db_path() -> Optional[Path]:
+    """Return the SQLite database file behind MARC_DB_URL, if there is one."""
+    url = os.environ.get("MARC_DB_URL", "")
+    if not url.startswith("sqlite"):
+        return None
+    database = make_url(url).database
+    if not database or database == ":memory:":
+        return None
+    if database.startswith("file:"):
+        database = database[len("file:") :].split("?", 1)[0]
+    return Path(database)
+
+
+def get_db_sync_marker() -> Optional[str]:
+    """Return a token that changes whenever a new database sync lands.
+
+    Combines the contents of MARC_DB_LAST_SYNC with the database file's
+    modification time. Returns None when neither is available (e.g. an
+    in-memory database), in which case callers should not cache anything.
+    """
+    parts = []
+    last_sync = get_db_last_sync()
+    if last_sync != "Unknown":
+        parts.append(last_sync)
+    db_path = get_db_path()
+    if db_path is not None:
+        try:
+            parts.append(str(db_path.stat().st_mtime_ns))
+        except OSError:
+            pass
+    return ":".join(parts) or None
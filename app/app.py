@@ -1,17 +1,16 @@
-import csv
 import os
 from typing import Optional
 from app import __version__, get_db_last_sync
 from flask import (
     Flask,
-    make_response,
+    Response,
     redirect,
     render_template,
     request,
     send_from_directory,
+    url_for,
 )
 from flask_sqlalchemy import SQLAlchemy
-from io import StringIO
 from marc_db import __version__ as marc_db_version
 from marc_db.models import (
     Aliquot,
@@ -24,16 +23,32 @@ from marc_db.models import (
 )
 from marc_db.views import (
     get_aliquots,
-    get_assemblies,
     get_assembly_qc,
-    get_isolates,
     get_taxonomic_assignments,
 )
 from pathlib import Path
-from sqlalchemy import select, text, func, desc
-from sqlalchemy.pool import NullPool
+from sqlalchemy import select, text, func
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from app.datatables import datatables_response, init_app, query_columns
-from app.nl_query import generate_sql, generate_sql_modification
+from app.engine import database_url, engine_options, init_app as init_engine
+from app.cache import make_key
+from app.export import EXPORT_FORMATS, export_response, json_response
+from app.http_cache import init_app as init_http_cache, skip_validators
+from app.index_advisor import init_app as init_index_advisor
+from app.instrumentation import init_app as init_instrumentation
+from app import batch, metrics
+from app import nl_jobs
+from app.results import cached_query, init_app as init_results
+from app.search import init_app as init_search
+from app import prevalence, stats, trees
+from app.stats import assembly_metrics_query
+from app.summary import empty_summary, get_summary
+from app.timeouts import (
+    QueryTimeout,
+    init_app as init_timeouts,
+    request_timeout,
+    statement_budget,
+)
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 app = Flask(__name__)
@@ -41,6 +56,8 @@ app.secret_key = os.urandom(12)
 
 IS_DEV_SITE = os.environ.get("MARC_DEV", "").lower() == "true"
 MARC_TREE_FP = os.environ.get("MARC_TREE_FP")
+# Rows of the AMR prevalence summaries on the species and antimicrobial pages
+AMR_SUMMARY_ROWS = 10
 
 
 def treefile_for_species(species_name: str) -> Optional[str]:
@@ -59,17 +76,11 @@ def inject_environment_flags():
 # whatever production server you are using instead. It's ok to leave this in when running the dev server.
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
-SQLALCHEMY_DATABASE_URI = os.environ["MARC_DB_URL"]
+SQLALCHEMY_DATABASE_URI = database_url(os.environ["MARC_DB_URL"])
 app.config["SQLALCHEMY_DATABASE_URI"] = SQLALCHEMY_DATABASE_URI
 print(SQLALCHEMY_DATABASE_URI)
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "poolclass": NullPool,
-    "connect_args": {
-        "uri": True,
-        "check_same_thread": False,
-        "timeout": 30,
-    },
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(SQLALCHEMY_DATABASE_URI)
+init_timeouts(app)
 db = SQLAlchemy(model_class=Base)
 db.init_app(app)
 
@@ -88,8 +99,82 @@ MARC_MODEL_FIELDS = {
     m.__table__.name: [c.name for c in m.__table__.columns] for m in MARC_MODELS
 }
 
+# Queries behind the browse tables, with the unique column each is paged by
+BROWSE_QUERIES = {
+    "isolates": (select(Isolate), Isolate.sample_id),
+    "aliquots": (select(Aliquot), None),
+    "assemblies": (
+        select(
+            Assembly.id,
+            Assembly.isolate_id,
+            Assembly.metagenomic_sample_id,
+            Assembly.metagenomic_run_id,
+            Assembly.nanopore_path.isnot(None).label("nanopore"),
+            Assembly.run_number,
+            Assembly.sunbeam_version,
+            Assembly.sbx_sga_version,
+            Assembly.ncbi_id,
+        ),
+        Assembly.id,
+    ),
+    "assembly_qc": (
+        select(
+            AssemblyQC.assembly_id,
+            Assembly.isolate_id.label("isolate_id"),
+            AssemblyQC.contig_count,
+            AssemblyQC.genome_size,
+            AssemblyQC.n50,
+            AssemblyQC.gc_content,
+            AssemblyQC.cds,
+            AssemblyQC.completeness,
+            AssemblyQC.contamination,
+            AssemblyQC.min_contig_coverage,
+            AssemblyQC.avg_contig_coverage,
+            AssemblyQC.max_contig_coverage,
+        )
+        .join(Assembly)
+        .order_by(AssemblyQC.assembly_id),
+        AssemblyQC.assembly_id,
+    ),
+    "taxonomic_assignments": (
+        select(
+            TaxonomicAssignment.assembly_id,
+            Assembly.isolate_id.label("isolate_id"),
+            TaxonomicAssignment.tool,
+            TaxonomicAssignment.classification,
+            TaxonomicAssignment.comment,
+        )
+        .join(Assembly)
+        .order_by(TaxonomicAssignment.assembly_id),
+        TaxonomicAssignment.id,
+    ),
+    "antimicrobials": (
+        select(
+            Antimicrobial.id,
+            Antimicrobial.assembly_id,
+            Assembly.isolate_id.label("isolate_id"),
+            Antimicrobial.contig_id,
+            Antimicrobial.gene_symbol,
+            Antimicrobial.gene_name,
+            Antimicrobial.accession,
+            Antimicrobial.element_type,
+            Antimicrobial.resistance_product,
+        )
+        .join(Assembly)
+        .order_by(Antimicrobial.id),
+        Antimicrobial.id,
+    ),
+}
+
 with app.app_context():
+    init_engine(app, db)
+    init_instrumentation(app, db)
+    init_http_cache(app)
+    metrics.init_app(db)
     init_app(db)
+    init_search(db)
+    init_results(db)
+    init_index_advisor(db, BROWSE_QUERIES)
 
 
 @app.route("/favicon.ico")
@@ -104,17 +189,11 @@ def favicon():
 @app.route("/")
 def index():
     try:
-        isolate_count = db.session.query(func.count(Isolate.sample_id)).scalar()
-        patient_count = db.session.query(
-            func.count(func.distinct(Isolate.subject_id))
-        ).scalar()
+        summary = get_summary(app, db)
     except Exception as e:
-        isolate_count = 0
-        patient_count = 0
-        print(f"Error fetching counts for index page: {e}")
+        summary = empty_summary()
+        print(f"Error fetching summary for index page: {e}")
 
-    # Get counts of each unique special collection
-    special_collections: dict[str, tuple[int, str]] = {}
     # Define description strings for known special collections
     special_collection_descriptions = {
         "Bacteremia": "Bacteria suspected to cause bacteremia",
@@ -123,47 +202,21 @@ def index():
         "AST": "Bacteria isolated from a range of non-blood clinical sources",
         "C. diff": "Clostridioides difficile isolates obtained from patients with C. difficile–positive infections",
     }
-
-    try:
-        # Get counts of all special collections in a single query
-        collection_counts = (
-            db.session.query(Isolate.special_collection, func.count(Isolate.sample_id))
-            .filter(Isolate.special_collection.is_not(None))
-            .group_by(Isolate.special_collection)
-            .all()
-        )
-
-        # Build the dictionary with counts and descriptions
-        special_collections = {
-            collection: (count, special_collection_descriptions.get(collection, ""))
-            for collection, count in collection_counts
-        }
-    except Exception as e:
-        print(f"Error fetching special collection counts: {e}")
-
-    try:
-        # Get counts of all the species in the collection
-        species = (
-            db.session.query(Isolate.suspected_organism, func.count(Isolate.sample_id).label("count"))
-            .filter(Isolate.suspected_organism.is_not(None))
-            .filter(Isolate.suspected_organism != "Unknown")
-            .group_by(Isolate.suspected_organism)
-            .order_by(desc("count"))
-            .limit(10)
-            .all()
-        )
-    except Exception as e:
-        print(f"Error fetching species counts: {e}")    
+    # Counts of each unique special collection, with their descriptions
+    special_collections: dict[str, tuple[int, str]] = {
+        collection: (count, special_collection_descriptions.get(collection, ""))
+        for collection, count in summary["special_collections"]
+    }
 
     return render_template(
         "index.html",
         version=__version__,
         marc_db_version=marc_db_version,
         last_sync=get_db_last_sync(),
-        isolate_count=isolate_count,
-        patient_count=patient_count,
+        isolate_count=summary["isolate_count"],
+        patient_count=summary["patient_count"],
         special_collection_counts=special_collections,
-        species_counts=species,
+        species_counts=summary["species"],
     )
 
 
@@ -179,22 +232,29 @@ def isolate_stats():
 
 @app.route("/api/isolates")
 def api_isolates():
-    return datatables_response(select(Isolate))
+    query, key = BROWSE_QUERIES["isolates"]
+    return datatables_response(query, key=key, search_index="isolates")
 
 
 @app.route("/isolate/<isolate_id>")
 def show_isolate(isolate_id):
-    isolate_records = get_isolates(db.session, isolate_id)
-    if not isolate_records or isolate_records[0] is None:
+    # Load the isolate and its assemblies in a single query
+    isolate = (
+        db.session.scalars(
+            select(Isolate)
+            .outerjoin(Isolate.assemblies)
+            .options(contains_eager(Isolate.assemblies))
+            .where(Isolate.sample_id == isolate_id)
+            .order_by(Assembly.id)
+        )
+        .unique()
+        .first()
+    )
+    if isolate is None:
         return render_template("dne.html", isolate_id=isolate_id)
-    isolate = isolate_records[0]
-    assemblies = (
-        db.session.query(Assembly)
-        .filter(Assembly.isolate_id == isolate.sample_id)
-        .order_by(Assembly.id)
-        .all()
+    return render_template(
+        "show_isolate.html", isolate=isolate, assemblies=list(isolate.assemblies)
     )
-    return render_template("show_isolate.html", isolate=isolate, assemblies=assemblies)
 
 
 @app.route("/aliquots")
@@ -204,7 +264,8 @@ def browse_aliquots():
 
 @app.route("/api/aliquots")
 def api_aliquots():
-    return datatables_response(select(Aliquot))
+    query, key = BROWSE_QUERIES["aliquots"]
+    return datatables_response(query, key=key)
 
 
 @app.route("/aliquot/<aliquot_id>")
@@ -222,59 +283,83 @@ def browse_assemblies():
 
 @app.route("/api/assemblies")
 def api_assemblies():
-    query = select(
-        Assembly.id,
-        Assembly.isolate_id,
-        Assembly.metagenomic_sample_id,
-        Assembly.metagenomic_run_id,
-        Assembly.nanopore_path.isnot(None).label("nanopore"),
-        Assembly.run_number,
-        Assembly.sunbeam_version,
-        Assembly.sbx_sga_version,
-        Assembly.ncbi_id,
-    )
-    return datatables_response(query)
+    query, key = BROWSE_QUERIES["assemblies"]
+    return datatables_response(query, key=key, search_index="assemblies")
 
 
 @app.route("/api/assemblies/metrics")
 def api_assembly_metrics():
-    metrics = (
-        db.session.query(
-            Assembly.id.label("assembly_id"),
-            Assembly.isolate_id.label("isolate_id"),
-            AssemblyQC.contig_count,
-            AssemblyQC.avg_contig_coverage,
-            AssemblyQC.genome_size,
-            AssemblyQC.completeness,
-            AssemblyQC.contamination,
-            Isolate.suspected_organism,
-            TaxonomicAssignment.classification,
-            TaxonomicAssignment.tool,
-        )
-        .join(AssemblyQC, Assembly.id == AssemblyQC.assembly_id)
-        .join(TaxonomicAssignment, Assembly.id == TaxonomicAssignment.assembly_id)
-        .outerjoin(Isolate, Assembly.isolate_id == Isolate.sample_id)
-        .order_by(Assembly.id)
-        .all()
+    """Per-assembly QC metrics with the species called by one taxonomic tool.
+
+    Optional query parameters: ``tool`` (default ``sylph``), ``species`` and
+    ``collection`` (an isolate special collection).
+    """
+    query = assembly_metrics_query(
+        tool=request.args.get("tool", "sylph"),
+        species=request.args.get("species"),
+        collection=request.args.get("collection"),
+    ).order_by(Assembly.id)
+    try:
+        return json_response(db.engine, query, timeout=request_timeout())
+    except QueryTimeout as e:
+        return {"error": str(e)}, 504
+
+
+@app.route("/api/amr/prevalence")
+def api_amr_prevalence():
+    """Share of assemblies carrying each AMR gene, by species and special collection.
+
+    Optional query parameters: ``tool`` (default ``sylph``), ``gene``,
+    ``element_type``, ``species``, ``collection``, ``by_collection`` (default
+    ``true``; ``false`` adds up the collections of each species),
+    ``min_assemblies`` (default 1) and ``format`` (``json`` or ``arrow``).
+    """
+    export_format = request.args.get("format", "json")
+    if export_format not in ("json", "arrow"):
+        return {"error": "format must be one of json, arrow"}, 400
+    counts = prevalence.prevalence_counts(db, tool=request.args.get("tool", "sylph"))
+    rows = prevalence.prevalence_rows(
+        counts,
+        gene=request.args.get("gene"),
+        element_type=request.args.get("element_type"),
+        species=request.args.get("species"),
+        collection=request.args.get("collection"),
+        by_collection=request.args.get("by_collection", "true").lower() != "false",
+        min_assemblies=request.args.get("min_assemblies", 1, type=int),
+    )
+    if export_format == "arrow":
+        try:
+            body = prevalence.arrow_stream(rows)
+        except ImportError as e:
+            return {"error": str(e)}, 400
+        return Response(body, mimetype=EXPORT_FORMATS["arrow"][0])
+    return {"columns": prevalence.COLUMNS, "data": rows}
+
+
+@app.route("/api/isolate_stats")
+def api_isolate_stats():
+    """Ready-to-plot histogram bins and a sampled scatter for the isolate stats page.
+
+    Optional query parameters: ``bins`` (1-100, default 10), ``scale``
+    (``linear`` or ``log``), ``tool`` (default ``sylph``) and ``points``, the
+    maximum number of scatter points (default 2000).
+    """
+    bins = request.args.get("bins", 10, type=int)
+    points = request.args.get("points", 2000, type=int)
+    scale = request.args.get("scale", "linear")
+    if not 1 <= bins <= 100:
+        return {"error": "bins must be between 1 and 100"}, 400
+    if not 0 <= points <= 10000:
+        return {"error": "points must be between 0 and 10000"}, 400
+    if scale not in stats.SCALES:
+        return {"error": f"scale must be one of {', '.join(stats.SCALES)}"}, 400
+    return stats.isolate_stats(
+        db,
+        bins=bins,
+        scale=scale,
+        tool=request.args.get("tool", "sylph"),
+        points=points,
     )
-    print(metrics[0])
-
-    return {
-        "data": [
-            {
-                "assembly_id": m.assembly_id,
-                "isolate_id": m.isolate_id,
-                "contig_count": m.contig_count,
-                "avg_contig_coverage": m.avg_contig_coverage,
-                "genome_size": m.genome_size,
-                "completeness": m.completeness,
-                "contamination": m.contamination,
-                "suspected_organism": m.classification,
-            }
-            for m in metrics
-            if m.tool == "sylph"
-        ]
-    }
 
 
 @app.route("/assembly_qc")
@@ -284,25 +369,8 @@ def browse_assembly_qc():
 
 @app.route("/api/assembly_qc")
 def api_assembly_qc():
-    query = (
-        select(
-            AssemblyQC.assembly_id,
-            Assembly.isolate_id.label("isolate_id"),
-            AssemblyQC.contig_count,
-            AssemblyQC.genome_size,
-            AssemblyQC.n50,
-            AssemblyQC.gc_content,
-            AssemblyQC.cds,
-            AssemblyQC.completeness,
-            AssemblyQC.contamination,
-            AssemblyQC.min_contig_coverage,
-            AssemblyQC.avg_contig_coverage,
-            AssemblyQC.max_contig_coverage,
-        )
-        .join(Assembly)
-        .order_by(AssemblyQC.assembly_id)
-    )
-    return datatables_response(query)
+    query, key = BROWSE_QUERIES["assembly_qc"]
+    return datatables_response(query, key=key)
 
 
 @app.route("/assembly_qc/<int:assembly_id>")
@@ -330,18 +398,8 @@ def browse_taxonomic_assignments():
 
 @app.route("/api/taxonomic_assignments")
 def api_taxonomic_assignments():
-    query = (
-        select(
-            TaxonomicAssignment.assembly_id,
-            Assembly.isolate_id.label("isolate_id"),
-            TaxonomicAssignment.tool,
-            TaxonomicAssignment.classification,
-            TaxonomicAssignment.comment,
-        )
-        .join(Assembly)
-        .order_by(TaxonomicAssignment.assembly_id)
-    )
-    return datatables_response(query)
+    query, key = BROWSE_QUERIES["taxonomic_assignments"]
+    return datatables_response(query, key=key, search_index="taxonomic_assignments")
 
 
 @app.route("/taxonomic_assignments/<int:assembly_id>")
@@ -368,22 +426,8 @@ def browse_antimicrobials():
 
 @app.route("/api/antimicrobials")
 def api_antimicrobials():
-    query = (
-        select(
-            Antimicrobial.id,
-            Antimicrobial.assembly_id,
-            Assembly.isolate_id.label("isolate_id"),
-            Antimicrobial.contig_id,
-            Antimicrobial.gene_symbol,
-            Antimicrobial.gene_name,
-            Antimicrobial.accession,
-            Antimicrobial.element_type,
-            Antimicrobial.resistance_product,
-        )
-        .join(Assembly)
-        .order_by(Antimicrobial.id)
-    )
-    return datatables_response(query)
+    query, key = BROWSE_QUERIES["antimicrobials"]
+    return datatables_response(query, key=key, search_index="antimicrobials")
 
 
 @app.route("/antimicrobial/<int:antimicrobial_id>")
@@ -397,13 +441,37 @@ def show_antimicrobial(antimicrobial_id: int):
     if not antimicrobial_record:
         return render_template("dne.html", antimicrobial_id=antimicrobial_id)
     antimicrobial_obj, isolate_id = antimicrobial_record
+    # None leaves the prevalence section out until the counts are ready
+    gene_prevalence = None
+    counts = None
+    if antimicrobial_obj.gene_symbol:
+        counts = prevalence.ready_counts(app, db)
+        if counts is None:
+            skip_validators()
+    if counts is not None:
+        gene_prevalence = sorted(
+            prevalence.prevalence_rows(
+                counts,
+                gene=antimicrobial_obj.gene_symbol,
+                by_collection=False,
+            ),
+            key=lambda row: -row[6],
+        )[:AMR_SUMMARY_ROWS]
     return render_template(
         "show_antimicrobial.html",
         antimicrobial=antimicrobial_obj,
         isolate_id=isolate_id,
+        gene_prevalence=gene_prevalence,
     )
 
 
+def treefile_path(species_name: str) -> Optional[Path]:
+    treefile_name = treefile_for_species(species_name)
+    if not MARC_TREE_FP or not treefile_name:
+        return None
+    return Path(MARC_TREE_FP) / treefile_name
+
+
 @app.route("/species/<path:species_name>")
 def show_species(species_name: str):
     assignment_count = (
@@ -411,35 +479,86 @@ def show_species(species_name: str):
         .filter(TaxonomicAssignment.classification == species_name)
         .scalar()
     )
-    treefile_name = treefile_for_species(species_name)
-    tree_content = None
-    tree_path = None
-    tree_error = None
-    if MARC_TREE_FP and treefile_name:
-        candidate = Path(MARC_TREE_FP) / treefile_name
-        tree_path = str(candidate)
-        if candidate.is_file():
-            try:
-                tree_content = candidate.read_text()
-            except Exception as exc:
-                tree_error = str(exc)
+    tree_path = treefile_path(species_name)
+    has_tree = tree_path is not None and tree_path.is_file()
+    # None leaves the AMR section out until the prevalence counts are ready
+    amr_genes, amr_gene_count = None, 0
+    counts = prevalence.ready_counts(app, db)
+    if counts is None:
+        skip_validators()
+    else:
+        rows = prevalence.prevalence_rows(
+            counts, species=species_name, by_collection=False
+        )
+        amr_genes, amr_gene_count = rows[:AMR_SUMMARY_ROWS], len(rows)
     return render_template(
         "show_species.html",
         species_name=species_name,
         assignment_count=assignment_count,
-        tree_path=tree_path,
-        tree_content=tree_content,
-        tree_error=tree_error,
+        amr_genes=amr_genes,
+        amr_gene_count=amr_gene_count,
+        tree_path=str(tree_path) if tree_path else None,
+        has_tree=has_tree,
         tree_root=MARC_TREE_FP,
     )
 
 
+@app.route("/api/species/<path:species_name>/tree")
+def api_species_tree(species_name: str):
+    """Newick tree for a species, trimmed to what will be drawn.
+
+    Optional query parameters: ``isolates``, a comma separated list of leaf
+    names to show the smallest clade around (or, with ``prune=true``, only
+    those leaves), and ``depth``, below which clades are collapsed into a
+    single leaf.
+    """
+    tree_path = treefile_path(species_name)
+    if tree_path is None or not tree_path.is_file():
+        return {"error": "No treefile found for this species"}, 404
+    isolates = [i for i in request.args.get("isolates", "").split(",") if i]
+    prune_tree = request.args.get("prune", "false").lower() == "true"
+    depth = request.args.get("depth", type=int)
+    if depth is not None and depth < 1:
+        return {"error": "depth must be at least 1"}, 400
+
+    # The tree can change without a DB sync, so it is tagged by its own mtime
+    etag = make_key(str(tree_path), tree_path.stat().st_mtime_ns, request.full_path)
+    etag = etag[:32]
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304)
+    try:
+        tree = trees.load_tree(tree_path)
+    except (OSError, ValueError) as e:
+        print(f"Error reading treefile {tree_path}: {e}")
+        return {"error": f"Unable to read treefile: {e}"}, 500
+
+    if isolates:
+        tree = (trees.prune if prune_tree else trees.subtree)(tree, isolates)
+        if tree is None:
+            return {"error": "None of the isolates are in this tree"}, 404
+    if depth is not None:
+        tree = trees.collapse(tree, depth)
+    response = Response(trees.to_newick(tree), mimetype="text/plain")
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route("/assembly/<int:assembly_id>")
 def show_assembly(assembly_id: int):
-    assemblies = get_assemblies(db.session, id=assembly_id)
-    if not assemblies or assemblies[0] is None:
+    # Load the whole object graph up front instead of one lazy load per relation
+    assembly = db.session.scalars(
+        select(Assembly)
+        .where(Assembly.id == assembly_id)
+        .options(
+            joinedload(Assembly.assembly_qc),
+            selectinload(Assembly.taxonomic_assignments),
+            selectinload(Assembly.antimicrobials),
+            selectinload(Assembly.contaminants),
+        )
+    ).first()
+    if assembly is None:
         return render_template("dne.html", assembly_id=assembly_id)
-    assembly = assemblies[0]
     qc = assembly.assembly_qc
     assignments = (
         list(assembly.taxonomic_assignments) if assembly.taxonomic_assignments else []
@@ -464,7 +583,8 @@ def query():
     error = None
     if query_str:
         try:
-            columns = query_columns(query_str)
+            with statement_budget(db.session.connection(), request_timeout()):
+                columns = query_columns(query_str)
         except Exception as e:
             error = str(e)
     return render_template(
@@ -481,37 +601,38 @@ def query():
 def download():
     if request.method == "POST":
         query = request.form["query"]
-        sql = text(query)
-        with app.app_context():
-            result = db.session.execute(sql).fetchall()
-            columns = result[0]._fields
-            rows = [row._asdict().values() for row in result]
-
-            csv_file = StringIO()
-            writer = csv.writer(csv_file)
-            writer.writerow(columns)
-            for row in rows:
-                writer.writerow(row)
-
-            # Create the response and set the appropriate headers
-            response = make_response(csv_file.getvalue())
-            response.headers["Content-Disposition"] = (
-                f"attachment; filename=marc_query_download.csv"
+        try:
+            return export_response(
+                db.engine,
+                query,
+                "marc_query_download",
+                export_format=request.form.get("format", "csv"),
+                gzipped=request.form.get("compression") == "gzip",
+                timeout=request_timeout(),
             )
-            response.headers["Content-type"] = "text/csv"
-            return response
+        except (ValueError, ImportError) as e:
+            return {"error": str(e)}, 400
+        except QueryTimeout as e:
+            return {"error": str(e)}, 504
 
     return redirect("/")
 
 
 @app.route("/api/query", methods=["POST"])
 def api_query():
-    """Return results for a custom SQL query in DataTables format."""
+    """Return results for a custom SQL query in DataTables format.
+
+    The result of the query is materialized on the first request, so paging,
+    sorting and searching it later does not run the query again.
+    """
     query = request.form.get("query")
     if not query:
         return {"error": "No query provided"}, 400
     try:
-        return datatables_response(query)
+        with statement_budget(db.session.connection(), request_timeout()):
+            return datatables_response(cached_query(db, query) or query)
+    except QueryTimeout as e:
+        return {"error": str(e)}, 504
     except Exception as e:
         print(f"Error executing query: {e}")  # Log the full error server-side
         return {"error": "Query execution failed"}, 500
@@ -526,6 +647,9 @@ def api_nl_query():
     if not question:
         return {"error": "No query provided"}, 400
 
+    # The NL stack is slow to import, so load it on the first request
+    from app.nl_query import generate_sql, generate_sql_modification
+
     if not starting_query:
         try:
             return generate_sql(question), 200
@@ -540,21 +664,79 @@ def api_nl_query():
             return {"error": "Query modification failed"}, 500
 
 
+@app.route("/api/nl_query/jobs", methods=["POST"])
+def api_nl_query_jobs():
+    """Start translating a natural language question into SQL.
+
+    Returns 202 with the job id and status; poll ``url`` for the result
+    while the status is ``pending``.
+    """
+    question = request.form.get("prompt")
+    starting_query = request.form.get("query")
+
+    if not question:
+        return {"error": "No query provided"}, 400
+
+    job_id = nl_jobs.submit(question, starting_query)
+    poll_url = url_for("api_nl_query_job", job_id=job_id)
+    job = {"job_id": job_id, "url": poll_url, **nl_jobs.get_job(job_id)}
+    return job, 202, {"Location": poll_url}
+
+
+@app.route("/api/nl_query/jobs/<job_id>")
+def api_nl_query_job(job_id):
+    """Status of an NL query job, with the SQL once it is done."""
+    job = nl_jobs.get_job(job_id)
+    if job is None:
+        return {"error": "Unknown job"}, 404
+    return job
+
+
 @app.route("/api", methods=["POST"])
 def api():
     try:
         if request.method == "POST":
             query = request.form["query"]
+            if "format" in request.form:
+                return export_response(
+                    db.engine,
+                    query,
+                    "marc_query",
+                    export_format=request.form["format"],
+                    gzipped=request.form.get("compression") == "gzip",
+                    timeout=request_timeout(),
+                )
             sql = text(query)
-            with app.app_context():
+            with statement_budget(db.session.connection(), request_timeout()):
                 result = db.session.execute(sql).fetchall()
-                return {"result": [dict(row) for row in result], "status_code": 200}
+            return {
+                "result": [dict(row._mapping) for row in result],
+                "status_code": 200,
+            }
 
         return {"result": ["No query provided"], "status_code": 400}
+    except QueryTimeout as e:
+        return {"result": [str(e)], "status_code": 504}
     except Exception as e:
         return {"result": [str(e)], "status_code": 500}
 
 
+@app.route("/api/batch", methods=["POST"])
+def api_batch():
+    """Look up many isolates or assemblies in one request.
+
+    Takes a JSON body ``{"type": "isolate" | "assembly", "ids": [...]}`` or a
+    form with ``type`` and an uploaded ``ids`` file, and streams back one
+    JSON line per id with the isolate and its assemblies' QC, taxonomic
+    assignments and AMR hits.
+    """
+    try:
+        id_type, ids = batch.parse_request(request)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return batch.batch_response(db, id_type, ids)
+
+
 @app.route("/health")
 def health():
     try:
@@ -570,8 +752,18 @@ def liveness():
     return {"status": "alive"}, 200
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics aggregated over all gunicorn workers."""
+    return metrics.metrics_response()
+
+
 @app.route("/reset_db_connections")
 def reset_db_connections():
+    """Close this worker's pooled connections so new ones open the current DB file.
+
+    Workers also recycle their pool on their own when the DB sync marker changes.
+    """
     try:
         db.engine.dispose()
         return {"status": "db_conns_reset"}, 200
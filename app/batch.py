@@ -0,0 +1,173 @@
+"""Bulk lookup of isolates or assemblies with everything known about them.
+
+Resolving thousands of sample ids one page or ``/api`` query at a time costs
+a round trip and a handful of queries per id. Instead, the ids are resolved
+in chunks of CHUNK_SIZE: for each chunk, one ``IN (...)`` query per table
+fetches the isolates, their assemblies, and the assemblies' QC, taxonomic
+assignments and AMR hits. The results are streamed back as newline-delimited
+JSON with one record per requested id, in the requested order, so neither the
+client nor the worker has to hold the whole result at once.
+
+Environment variables:
+
+- MARC_BATCH_MAX_IDS: largest number of ids accepted in one request
+  (default 50,000)
+"""
+
+import json
+import os
+import re
+from typing import Iterable, Iterator
+from flask import Request, Response, stream_with_context
+from flask_sqlalchemy import SQLAlchemy
+from marc_db.models import (
+    Antimicrobial,
+    Assembly,
+    AssemblyQC,
+    Isolate,
+    TaxonomicAssignment,
+)
+from sqlalchemy import select
+
+# Ids per IN (...) query, well below SQLite's bound parameter limit
+CHUNK_SIZE = 500
+ID_TYPES = ("isolate", "assembly")
+
+
+def max_ids() -> int:
+    return int(os.environ.get("MARC_BATCH_MAX_IDS", 50_000))
+
+
+def parse_request(request: Request) -> tuple[str, list]:
+    """Return the id type and the (deduplicated) ids of a batch request.
+
+    Accepts a JSON body ``{"type": "isolate", "ids": [...]}`` or a form with
+    a ``type`` field and an ``ids`` file upload holding ids separated by
+    whitespace or commas. Raises ValueError for a malformed request.
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("ids"), list):
+            raise ValueError('Expected a JSON object with an "ids" list')
+        id_type = body.get("type", "isolate")
+        ids = body["ids"]
+    elif "ids" in request.files:
+        id_type = request.form.get("type", "isolate")
+        text = request.files["ids"].read().decode("utf-8", errors="replace")
+        ids = re.split(r"[\s,]+", text)
+    else:
+        raise ValueError("Provide ids as a JSON body or an uploaded 'ids' file")
+
+    if id_type not in ID_TYPES:
+        raise ValueError(f"type must be one of {', '.join(ID_TYPES)}")
+    ids = [str(i).strip() for i in ids if str(i).strip()]
+    if id_type == "assembly":
+        try:
+            ids = [int(i) for i in ids]
+        except ValueError:
+            raise ValueError("Assembly ids must be integers") from None
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > max_ids():
+        raise ValueError(f"At most {max_ids()} ids can be looked up at once")
+    return id_type, ids
+
+
+def _chunks(ids: list, size: int = CHUNK_SIZE) -> Iterator[list]:
+    for start in range(0, len(ids), size):
+        yield ids[start : start + size]
+
+
+def _rows(database: SQLAlchemy, model, column, values: Iterable) -> list[dict]:
+    values = list(values)
+    if not values:
+        return []
+    table = model.__table__
+    result = database.session.execute(select(table).where(column.in_(values)))
+    return [dict(row._mapping) for row in result]
+
+
+def _group(rows: list[dict], key: str) -> dict:
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[key], []).append(row)
+    return groups
+
+
+def _resolve_chunk(database: SQLAlchemy, id_type: str, ids: list) -> Iterator[dict]:
+    """Yield the record of each id in ``ids``, using one query per table."""
+    if id_type == "isolate":
+        isolates = _rows(database, Isolate, Isolate.sample_id, ids)
+        assemblies = _rows(
+            database, Assembly, Assembly.isolate_id, [i["sample_id"] for i in isolates]
+        )
+    else:
+        assemblies = _rows(database, Assembly, Assembly.id, ids)
+        isolates = _rows(
+            database,
+            Isolate,
+            Isolate.sample_id,
+            {a["isolate_id"] for a in assemblies if a["isolate_id"] is not None},
+        )
+
+    assembly_ids = [a["id"] for a in assemblies]
+    qc = _group(
+        _rows(database, AssemblyQC, AssemblyQC.assembly_id, assembly_ids), "assembly_id"
+    )
+    taxonomy = _group(
+        _rows(
+            database,
+            TaxonomicAssignment,
+            TaxonomicAssignment.assembly_id,
+            assembly_ids,
+        ),
+        "assembly_id",
+    )
+    amr = _group(
+        _rows(database, Antimicrobial, Antimicrobial.assembly_id, assembly_ids),
+        "assembly_id",
+    )
+    for assembly in assemblies:
+        assembly["assembly_qc"] = (qc.get(assembly["id"]) or [None])[0]
+        assembly["taxonomic_assignments"] = taxonomy.get(assembly["id"], [])
+        assembly["antimicrobials"] = amr.get(assembly["id"], [])
+
+    isolates_by_id = {i["sample_id"]: i for i in isolates}
+    if id_type == "isolate":
+        assemblies_by_isolate = _group(assemblies, "isolate_id")
+        for sample_id in ids:
+            isolate = isolates_by_id.get(sample_id)
+            yield {
+                "id": sample_id,
+                "found": isolate is not None,
+                "isolate": isolate,
+                "assemblies": assemblies_by_isolate.get(sample_id, []),
+            }
+    else:
+        assemblies_by_id = {a["id"]: a for a in assemblies}
+        for assembly_id in ids:
+            assembly = assemblies_by_id.get(assembly_id)
+            yield {
+                "id": assembly_id,
+                "found": assembly is not None,
+                "isolate": (
+                    isolates_by_id.get(assembly["isolate_id"]) if assembly else None
+                ),
+                "assemblies": [assembly] if assembly else [],
+            }
+
+
+def ndjson_chunks(database: SQLAlchemy, id_type: str, ids: list) -> Iterator[str]:
+    """Yield one chunk of newline-delimited JSON records per chunk of ids."""
+    for chunk in _chunks(ids):
+        yield "".join(
+            json.dumps(record, default=str) + "\n"
+            for record in _resolve_chunk(database, id_type, chunk)
+        )
+
+
+def batch_response(database: SQLAlchemy, id_type: str, ids: list) -> Response:
+    """Return a streamed NDJSON response with the record of every id."""
+    return Response(
+        stream_with_context(ndjson_chunks(database, id_type, ids)),
+        mimetype="application/x-ndjson",
+    )
@@ -0,0 +1,155 @@
+"""Small on-disk cache shared by every gunicorn worker.
+
+Entries live in a SQLite file under MARC_CACHE_DIR (defaults to a directory in
+the system temp dir) so that a value computed by one worker is visible to the
+others. Values must be JSON serializable.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional
+from app.metrics import record_cache_lookup
+
+_MISSING = object()
+# Seconds between updates of an entry's last access time. Hits within this
+# interval are pure reads, so they don't contend for the file's write lock.
+TOUCH_INTERVAL = 60
+
+
+def cache_dir() -> Path:
+    """Return the directory holding the shared cache files."""
+    path = Path(
+        os.environ.get("MARC_CACHE_DIR")
+        or Path(tempfile.gettempdir()) / "marc_web_cache"
+    )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def make_key(*parts) -> str:
+    """Hash arbitrary JSON-able key parts into a fixed length cache key."""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SharedCache:
+    """Key/value cache with LRU eviction and an optional TTL.
+
+    Parameters
+    ----------
+    name: str
+        Name of the cache, used as the file name inside ``cache_dir()``.
+    max_entries: int
+        Least recently used entries are evicted beyond this many. Access times
+        are only updated every TOUCH_INTERVAL seconds, so recency is approximate.
+    ttl: float | None
+        Seconds after which an entry is considered stale.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(cache_dir() / f"{self.name}.sqlite", timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._read(key)
+        record_cache_lookup(self.name, value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def _read(self, key: str) -> Any:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, created, accessed FROM entries WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    return _MISSING
+                now = time.time()
+                if self.ttl is not None and now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    return _MISSING
+                if now - row[2] > TOUCH_INTERVAL:
+                    conn.execute(
+                        "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+                    )
+                return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"Error reading {self.name} cache: {e}")
+            return _MISSING
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    "SELECT key FROM entries ORDER BY accessed DESC "
+                    "LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            print(f"Error writing {self.name} cache: {e}")
+
+    def add(self, key: str, value: Any) -> bool:
+        """Store ``value`` unless ``key`` is already cached; return whether it was.
+
+        Unlike a ``get`` followed by a ``set``, only one of several workers
+        adding the same key at once succeeds.
+        """
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                if self.ttl is not None:
+                    conn.execute(
+                        "DELETE FROM entries WHERE key = ? AND created < ?",
+                        (key, now - self.ttl),
+                    )
+                added = conn.execute(
+                    "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                ).rowcount
+        except sqlite3.Error as e:
+            print(f"Error writing {self.name} cache: {e}")
+            return False
+        return added == 1
+
+    def get_or_set(self, key: str, factory: Callable[[], Any]) -> Any:
+        """Return the cached value for ``key``, computing it on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def clear(self) -> None:
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM entries")
+        except sqlite3.Error as e:
+            print(f"Error clearing {self.name} cache: {e}")
@@ -1,10 +1,38 @@
 # Utility functions for DataTables responses
-from flask import request
+import base64
+import binascii
+import datetime
+import json
+from app import get_db_sync_marker, search
+from app.filters import column_filter
+from app.cache import SharedCache, make_key
+from app.instrumentation import timed
+from app.timeouts import is_timeout
+from flask import Response, current_app, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text, func, or_, cast, String, select
+from sqlalchemy import (
+    ARRAY,
+    JSON,
+    Boolean,
+    Integer,
+    LargeBinary,
+    String,
+    and_,
+    cast,
+    false,
+    func,
+    or_,
+    select,
+    text,
+)
 from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.sql import Select
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # `db` will be provided by the application using this module.
 db: SQLAlchemy
 
@@ -15,8 +43,207 @@ def init_app(database: SQLAlchemy) -> None:
     db = database
 
 
+# Row counts only change when a new database sync lands, so they are shared
+# between workers and keyed on the sync marker.
+_count_cache = SharedCache("counts", max_entries=4096)
+
+
+def _cached_scalar(stmt, params=None):
+    """Execute a scalar query, reusing the result until the next DB sync."""
+    marker = get_db_sync_marker()
+    if marker is None:
+        return db.session.scalar(stmt, params)
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    key = make_key(marker, compiled.string, compiled.params, params)
+    return _count_cache.get_or_set(key, lambda: db.session.scalar(stmt, params))
+
+
 def _execute_count(q):
-    return db.session.scalar(select(func.count()).select_from(q.subquery()))
+    return _cached_scalar(select(func.count()).select_from(q.subquery()))
+
+
+def _encode_cursor(cursor: dict) -> str:
+    raw = json.dumps(cursor, default=lambda v: v.isoformat())
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(token, sort_cols):
+    """Return the cursor dict for ``token``, or None if it is missing or invalid.
+
+    Cursors come from the client, so anything that doesn't decode to a page
+    position and seek values of ``sort_cols`` is ignored, which falls back
+    to OFFSET paging.
+    """
+    if not token:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (binascii.Error, ValueError, UnicodeError):
+        return None
+    if not isinstance(cursor, dict) or not {
+        "context",
+        "start",
+        "count",
+        "first",
+        "last",
+    } <= set(cursor):
+        return None
+    for field in ("start", "count"):
+        value = cursor[field]
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            return None
+    for field in ("first", "last"):
+        values = cursor[field]
+        if values is None:
+            continue
+        if not isinstance(values, list) or len(values) != len(sort_cols):
+            return None
+        try:
+            cursor[field] = [_decode_value(c, v) for c, v in zip(sort_cols, values)]
+        except (TypeError, ValueError):
+            return None
+    return cursor
+
+
+def _decode_value(col, value):
+    """Convert a JSON cursor value back to the Python type of ``col``.
+
+    Raises ValueError for a value that doesn't fit the column.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, (str, int, float)):
+        raise ValueError(f"Invalid cursor value {value!r}")
+    try:
+        python_type = col.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type in (datetime.date, datetime.datetime, datetime.time):
+        return python_type.fromisoformat(value)
+    if python_type is str and not isinstance(value, str):
+        raise ValueError(f"Invalid cursor value {value!r}")
+    if python_type in (int, float, bool) and isinstance(value, str):
+        raise ValueError(f"Invalid cursor value {value!r}")
+    return value
+
+
+def _seek_expression(col):
+    """Return an expression that orders like ``col`` and supports ``<``/``>``.
+
+    Booleans are compared as integers, since SQLAlchemy only allows equality
+    tests against True/False. Returns None for types without a usable order,
+    whose pages are then fetched with OFFSET.
+    """
+    if isinstance(col.type, Boolean):
+        return cast(col, Integer)
+    if isinstance(col.type, (JSON, ARRAY, LargeBinary)):
+        return None
+    return col
+
+
+def _order_by(col, descending):
+    # Pin NULL placement so seeking behaves the same on every dialect
+    return col.desc().nulls_last() if descending else col.asc().nulls_first()
+
+
+def _seek_after(cols, values, descending):
+    """Predicate for rows sorting strictly after ``values`` on ``cols``."""
+    clauses = []
+    for idx, (col, value) in enumerate(zip(cols, values)):
+        if descending:
+            after = false() if value is None else or_(col < value, col.is_(None))
+        else:
+            after = col.is_not(None) if value is None else col > value
+        equal = [
+            c.is_(None) if v is None else c == v
+            for c, v in zip(cols[:idx], values[:idx])
+        ]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses)
+
+
+def _rows_data(rows, columns):
+    """Row objects keyed by column name, or bare row arrays in compact mode."""
+    if request.values.get("format") == "compact":
+        return [list(r) for r in rows]
+    return [dict(zip(columns, r)) for r in rows]
+
+
+def _compact_response(payload) -> Response:
+    """Encode ``payload`` with orjson when it is installed."""
+    default = current_app.json.default
+    if orjson is None:
+        body = json.dumps(payload, default=default, separators=(",", ":"))
+    else:
+        # Pass dates to Flask's encoder so both modes format them the same
+        body = orjson.dumps(
+            payload, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return Response(body, mimetype="application/json")
+
+
+def _keyset_page(query, sort_col, descending, key, start, length, context):
+    """Fetch one page ordered by ``sort_col`` then ``key``.
+
+    When the request carries the cursor of the neighbouring page, the page is
+    found by seeking past that page's first/last row so the database never
+    walks the skipped rows. Random page jumps fall back to OFFSET.
+    """
+    key = key.expression if hasattr(key, "expression") else key
+    if sort_col is None or sort_col.compare(key):
+        sort_cols = [key]
+    else:
+        sort_cols = [sort_col, key]
+    seek_cols = [_seek_expression(c) for c in sort_cols]
+    seekable = all(c is not None for c in seek_cols)
+    if seekable:
+        sort_cols = seek_cols
+    page_query = query.order_by(None).add_columns(
+        *[c.label(f"_seek_{idx}") for idx, c in enumerate(sort_cols)]
+    )
+
+    cursor = _decode_cursor(request.values.get("cursor"), sort_cols)
+    backwards = False
+    if not seekable or cursor is None or cursor["context"] != context:
+        page_query = page_query.offset(start)
+    elif start == cursor["start"] + cursor["count"] and cursor["last"]:
+        page_query = page_query.where(
+            _seek_after(sort_cols, cursor["last"], descending)
+        )
+    elif start + length == cursor["start"] and cursor["first"]:
+        page_query = page_query.where(
+            _seek_after(sort_cols, cursor["first"], not descending)
+        )
+        backwards = True
+    else:
+        page_query = page_query.offset(start)
+
+    page_query = page_query.order_by(
+        *[_order_by(c, descending != backwards) for c in sort_cols]
+    ).limit(length)
+    rows = db.session.execute(page_query).all()
+    if backwards:
+        rows.reverse()
+
+    seek_keys = [f"_seek_{idx}" for idx in range(len(sort_cols))]
+    columns = [c.key for c in query.selected_columns]
+    data = _rows_data([r[: len(columns)] for r in rows], columns)
+
+    def seek_values(r):
+        if not seekable:
+            return None
+        return [r._mapping[k] for k in seek_keys]
+
+    next_cursor = _encode_cursor(
+        {
+            "context": context,
+            "start": start,
+            "count": len(rows),
+            "first": seek_values(rows[0]) if rows else None,
+            "last": seek_values(rows[-1]) if rows else None,
+        }
+    )
+    return data, next_cursor
 
 
 def query_columns(query):
@@ -30,14 +257,7 @@ def query_columns(query):
     raise TypeError("query must be a SQLAlchemy Select or SQL string")
 
 
-def datatables_response(query):
-    """Return query results formatted for DataTables server-side processing.
-
-    Parameters
-    ----------
-    query: sqlalchemy.sql.Select | str
-        Query to execute. May be a SQLAlchemy Select object or a raw SQL string.
-    """
+def _datatables_payload(query, key, search_index):
     values = request.values
 
     def empty_response(columns):
@@ -56,7 +276,9 @@ def datatables_response(query):
 
         try:
             columns = query_columns(query)
-        except (OperationalError, ProgrammingError):
+        except (OperationalError, ProgrammingError) as e:
+            if is_timeout(e):
+                raise
             return empty_response([])
 
         quoted_cols = [f'"{c}"' for c in columns]
@@ -95,18 +317,22 @@ def datatables_response(query):
 
         base_select = f"SELECT * FROM ({base_sql}) AS q"
         try:
-            total_records = db.session.scalar(
-                text(f"SELECT COUNT(*) FROM ({base_sql}) AS q")
-            )
+            with timed("count"):
+                total_records = _cached_scalar(
+                    text(f"SELECT COUNT(*) FROM ({base_sql}) AS q")
+                )
 
             filtered_sql = base_select
             if filters:
                 filtered_sql += " WHERE " + " AND ".join(filters)
 
-            records_filtered = db.session.scalar(
-                text(f"SELECT COUNT(*) FROM ({filtered_sql}) AS sq"),
-                params,
-            )
+            records_filtered = total_records
+            if filters:
+                with timed("filtered_count"):
+                    records_filtered = _cached_scalar(
+                        text(f"SELECT COUNT(*) FROM ({filtered_sql}) AS sq"),
+                        params,
+                    )
 
             order_idx = values.get("order[0][column]", type=int)
             if order_idx is not None and 0 <= order_idx < len(columns):
@@ -119,11 +345,14 @@ def datatables_response(query):
             paginated_sql = filtered_sql + " LIMIT :limit OFFSET :offset"
             params.update({"limit": length, "offset": start})
 
-            rows = db.session.execute(text(paginated_sql), params).mappings().all()
-        except (OperationalError, ProgrammingError):
+            with timed("page"):
+                rows = db.session.execute(text(paginated_sql), params).all()
+        except (OperationalError, ProgrammingError) as e:
+            if is_timeout(e):
+                raise
             return empty_response(columns)
 
-        data = [dict(r) for r in rows]
+        data = _rows_data(rows, columns)
 
         return {
             "draw": int(values.get("draw", 1)),
@@ -140,43 +369,108 @@ def datatables_response(query):
     columns = [c.key for c in query.selected_columns]
     base_query = query.with_only_columns(query.selected_columns)
     try:
-        total_records = _execute_count(base_query)
+        with timed("count"):
+            total_records = _execute_count(base_query)
+        filtered = False
 
         search_value = values.get("search[value]")
         if search_value:
-            filters = [
-                cast(c, String).ilike(f"%{search_value}%")
-                for c in query.selected_columns
-            ]
-            base_query = base_query.where(or_(*filters))
+            condition = None
+            if search_index is not None and key is not None:
+                condition = search.match_filter(
+                    db, search_index, query, key, search_value
+                )
+            if condition is None:
+                condition = or_(
+                    *[
+                        cast(c, String).ilike(f"%{search_value}%")
+                        for c in query.selected_columns
+                    ]
+                )
+            base_query = base_query.where(condition)
+            filtered = True
 
         for idx, col in enumerate(query.selected_columns):
             val = values.get(f"columns[{idx}][search][value]")
             if val:
-                base_query = base_query.where(cast(col, String).ilike(f"%{val}%"))
+                base_query = base_query.where(column_filter(col, val))
+                filtered = True
 
+        # Count before ordering so every sort of the same filter shares a cache entry
+        records_filtered = total_records
+        if filtered:
+            with timed("filtered_count"):
+                records_filtered = _execute_count(base_query)
+
+        sort_col = None
         order_idx = values.get("order[0][column]")
         if order_idx is not None:
-            col = query.selected_columns[int(order_idx)]
-            if values.get("order[0][dir]", "asc") == "desc":
-                col = col.desc()
-            base_query = base_query.order_by(col)
-
-        records_filtered = _execute_count(base_query)
+            sort_col = query.selected_columns[int(order_idx)]
+        descending = values.get("order[0][dir]", "asc") == "desc"
 
         start = values.get("start", 0, type=int)
         length = values.get("length", 20, type=int)
-        paginated = base_query.offset(start).limit(length)
-        rows = db.session.execute(paginated).all()
+        cursor = None
+        if key is not None:
+            context = make_key(
+                order_idx,
+                descending,
+                length,
+                {k: v for k, v in values.items() if "[search]" in k},
+            )
+            with timed("page"):
+                data, cursor = _keyset_page(
+                    base_query, sort_col, descending, key, start, length, context
+                )
+        else:
+            if sort_col is not None:
+                base_query = base_query.order_by(
+                    sort_col.desc() if descending else sort_col
+                )
+            paginated = base_query.offset(start).limit(length)
+            with timed("page"):
+                rows = db.session.execute(paginated).all()
+            data = _rows_data(rows, columns)
     except (OperationalError, ProgrammingError):
         return empty_response(columns)
 
-    data = [dict(r._mapping) for r in rows]
-
-    return {
+    response = {
         "draw": int(values.get("draw", 1)),
         "recordsTotal": total_records,
         "recordsFiltered": records_filtered,
         "data": data,
         "columns": columns,
     }
+    if cursor is not None:
+        response["cursor"] = cursor
+    return response
+
+
+def datatables_response(query, key=None, search_index=None):
+    """Return query results formatted for DataTables server-side processing.
+
+    Parameters
+    ----------
+    query: sqlalchemy.sql.Select | str
+        Query to execute. May be a SQLAlchemy Select object or a raw SQL string.
+    key: sqlalchemy.sql.ColumnElement | None
+        Unique column of a Select query. When given, rows are ordered by the
+        requested sort column and then ``key``, and the response carries a
+        ``cursor`` that lets the next or previous page be fetched by keyset
+        seek instead of OFFSET.
+    search_index: str | None
+        Name of the full-text index (see ``app.search``) used to answer the
+        global search box for a Select query with a ``key``.
+
+    Column search values of a Select query are typed filters (exact, prefix,
+    range and list matches; see ``app.filters``) on each column's own type.
+
+    Requests with ``format=compact`` get each row of ``data`` as an array of
+    values in the order of ``columns`` instead of an object, which makes for
+    a much smaller and faster to encode response for wide tables.
+    """
+    payload = _datatables_payload(query, key, search_index)
+    with timed("json"):
+        if request.values.get("format") == "compact":
+            return _compact_response(payload)
+        return jsonify(payload)
@@ -0,0 +1,110 @@
+"""SQLAlchemy engine configuration for the web tier.
+
+The web app only reads the mARC database, so file-backed SQLite databases are
+opened read-only (``mode=ro``, or ``immutable=1`` with MARC_DB_IMMUTABLE=true)
+through a per-worker connection pool. Every new connection is tuned for reads
+with PRAGMAs, and the pool is recycled whenever a new DB sync lands so no
+connection keeps reading a replaced database file.
+
+Environment variables:
+
+- MARC_DB_READ_ONLY: open file databases read-only (default true)
+- MARC_DB_IMMUTABLE: also promise SQLite the file never changes (default false)
+- MARC_DB_POOL_SIZE: connections kept open per worker (default 5)
+- MARC_DB_MMAP_SIZE: bytes of the database to memory map (default 256 MiB)
+- MARC_DB_CACHE_SIZE: page cache size in KiB (default 64 MiB)
+"""
+
+import os
+from urllib.parse import urlencode
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+from app import get_db_sync_marker
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() == "true"
+
+
+def _is_memory_db(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:"
+
+
+def read_only() -> bool:
+    return _env_flag("MARC_DB_READ_ONLY", True)
+
+
+def database_url(url: str) -> str:
+    """Return ``url`` rewritten to open a SQLite file as a read-only URI."""
+    if not url.startswith("sqlite") or _is_memory_db(url) or not read_only():
+        return url
+    parsed = make_url(url)
+    if parsed.database.startswith("file:"):
+        return url
+    params = {**parsed.query, "mode": "ro", "uri": "true"}
+    if _env_flag("MARC_DB_IMMUTABLE", False):
+        params["immutable"] = "1"
+    return f"{parsed.drivername}:///file:{parsed.database}?{urlencode(params)}"
+
+
+def engine_options(url: str) -> dict:
+    """Return SQLALCHEMY_ENGINE_OPTIONS for ``url``."""
+    if not url.startswith("sqlite"):
+        return {"pool_pre_ping": True}
+    connect_args = {"uri": True, "check_same_thread": False, "timeout": 30}
+    if _is_memory_db(url):
+        # Every connection to :memory: is a new empty database, so share one
+        return {"poolclass": StaticPool, "connect_args": connect_args}
+    return {
+        "poolclass": QueuePool,
+        "pool_size": int(os.environ.get("MARC_DB_POOL_SIZE", 5)),
+        "max_overflow": 10,
+        "connect_args": connect_args,
+    }
+
+
+def init_app(app: Flask, database: SQLAlchemy) -> None:
+    """Register connection setup and pool recycling on the engine."""
+    engine = database.engine
+    last_marker = get_db_sync_marker()
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        connection_record.info["pid"] = os.getpid()
+        if engine.dialect.name != "sqlite":
+            return
+        mmap_size = int(os.environ.get("MARC_DB_MMAP_SIZE", 256 * 1024 * 1024))
+        cache_size = int(os.environ.get("MARC_DB_CACHE_SIZE", 64 * 1024))
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA mmap_size = {mmap_size}")
+        cursor.execute(f"PRAGMA cache_size = -{cache_size}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        if read_only() and not _is_memory_db(str(engine.url)):
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        # Connections opened before gunicorn forked must not be shared
+        if connection_record.info.get("pid") != os.getpid():
+            connection_record.dbapi_connection = connection_proxy.dbapi_connection = (
+                None
+            )
+            raise exc.DisconnectionError(
+                "Connection belongs to another process, reconnecting"
+            )
+
+    @app.before_request
+    def recycle_pool_on_sync():
+        nonlocal last_marker
+        if _is_memory_db(str(engine.url)):
+            # Disposing the only connection would discard the whole database
+            return
+        marker = get_db_sync_marker()
+        if marker != last_marker:
+            last_marker = marker
+            engine.dispose()
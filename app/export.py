@@ -0,0 +1,317 @@
+"""Streaming export of query results for the download endpoints.
+
+Rows are pulled from the database in batches on a dedicated connection and
+encoded as they go, so a worker only ever holds one batch of an export in
+memory regardless of the size of the result. Besides CSV, results can be
+exported as an Apache Arrow IPC stream or a Parquet file (requires pyarrow).
+"""
+
+import csv
+import json
+import time
+import zlib
+from io import StringIO
+from typing import Iterable, Iterator, Optional
+from flask import Response, stream_with_context
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from app.timeouts import QueryTimeout, clear_budget, is_timeout, start_budget
+
+BATCH_SIZE = 5000
+
+# Export format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", ".arrows"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+
+def stream_query(engine: Engine, query, timeout: Optional[float] = None):
+    """Execute ``query`` (a Select or SQL string) with a server-side cursor.
+
+    Returns the open connection and its result; the caller is responsible for
+    closing the connection (see ``close_stream``) once the result has been
+    consumed. Errors in the SQL are raised here, before any part of the
+    response has been sent. ``timeout`` is a time budget in seconds for
+    executing the statement, after which QueryTimeout is raised.
+    """
+    conn = engine.connect()
+    try:
+        start_budget(conn, timeout)
+        result = conn.execution_options(
+            stream_results=True, yield_per=BATCH_SIZE
+        ).execute(text(query) if isinstance(query, str) else query)
+    except Exception as e:
+        close_stream(conn)
+        if isinstance(e, DBAPIError) and is_timeout(e):
+            raise QueryTimeout(timeout) from e
+        raise
+    return conn, result
+
+
+def close_stream(conn) -> None:
+    clear_budget(conn)
+    conn.close()
+
+
+def _error_marker(error: Exception, export_format: str = "csv"):
+    """Return the chunk that ends an export cut short by ``error``.
+
+    CSV exports get a final comment line; for JSON and the binary formats
+    the marker also makes the truncated body fail to parse instead of
+    reading as short.
+    """
+    message = f"\n# ERROR: export cut short: {error}\n"
+    if export_format in ("csv", "json"):
+        return message
+    return message.encode("utf-8")
+
+
+def _checked(
+    chunks: Iterable,
+    conn,
+    timeout: Optional[float],
+    spent: float = 0.0,
+    export_format: str = "csv",
+) -> Iterator:
+    """Yield ``chunks``, ending with an error marker if producing them fails.
+
+    ``timeout`` only counts the time spent producing chunks, ``spent`` seconds
+    of which were used executing the query: the budget is re-armed with what
+    is left of it before each chunk, so a client that reads slowly doesn't
+    run the export out of time.
+    """
+    remaining = timeout
+    if timeout:
+        remaining -= spent
+    chunks = iter(chunks)
+    while True:
+        started = time.monotonic()
+        try:
+            if timeout:
+                if remaining <= 0:
+                    raise QueryTimeout(timeout)
+                start_budget(conn, remaining)
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        except Exception as e:
+            if isinstance(e, DBAPIError) and is_timeout(e):
+                e = QueryTimeout(timeout)
+            print(f"Export cut short: {e}")
+            yield _error_marker(e, export_format)
+            return
+        if timeout:
+            remaining -= time.monotonic() - started
+        yield chunk
+
+
+def csv_chunks(result) -> Iterator[str]:
+    """Yield a CSV rendering of ``result``, one chunk per batch of rows."""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(result.keys())
+    for rows in result.partitions(BATCH_SIZE):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks: Iterable) -> Iterator[bytes]:
+    """Gzip a stream of text or byte chunks on the fly."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def json_chunks(result) -> Iterator[str]:
+    """Yield ``{"data": [...]}`` with one object per row, one chunk per batch."""
+    keys = list(result.keys())
+    yield '{"data": ['
+    separator = ""
+    for rows in result.partitions(BATCH_SIZE):
+        chunk = ",".join(json.dumps(dict(zip(keys, row)), default=str) for row in rows)
+        yield separator + chunk
+        separator = ","
+    yield "]}"
+
+
+def json_response(engine: Engine, query, timeout: Optional[float] = None) -> Response:
+    """Return the rows of ``query`` as a streamed JSON ``data`` array.
+
+    Raises QueryTimeout if the query runs out of its ``timeout`` before
+    returning a first row; running out later, or any other error while
+    streaming, ends the body with an error marker so it can't parse.
+    """
+    started = time.monotonic()
+    conn, result = stream_query(engine, query, timeout)
+    chunks = _checked(
+        json_chunks(result), conn, timeout, time.monotonic() - started, "json"
+    )
+    response = Response(stream_with_context(chunks), mimetype="application/json")
+    response.call_on_close(lambda: close_stream(conn))
+    return response
+
+
+class _ChunkSink:
+    """Write-only file object that hands pyarrow's output back in chunks."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _string_array(values):
+    import pyarrow as pa
+
+    return pa.array([None if v is None else str(v) for v in values], pa.string())
+
+
+def _infer_array(values):
+    """Build an array of the type inferred from ``values``.
+
+    Columns pyarrow can't settle on one type for (mixed types, or only NULLs)
+    become strings.
+    """
+    import pyarrow as pa
+
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return _string_array(values)
+    if pa.types.is_null(array.type):
+        return array.cast(pa.string())
+    return array
+
+
+def _to_array(values, arrow_type):
+    """Build an array of ``arrow_type``, coercing values the inferred type rejects."""
+    import pyarrow as pa
+
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        if pa.types.is_string(arrow_type):
+            return _string_array(values)
+        return pa.array(values).cast(arrow_type)
+
+
+def record_batches(result) -> Iterator:
+    """Yield pyarrow RecordBatches of ``result``, one per batch of rows.
+
+    Column types are inferred from the first batch (see ``_infer_array``), so
+    the schema is settled before anything is written, and later batches are
+    coerced to it.
+    """
+    import pyarrow as pa
+
+    names = list(result.keys())
+    schema = None
+    for rows in result.partitions(BATCH_SIZE):
+        columns = list(zip(*rows))
+        if schema is None:
+            arrays = [_infer_array(values) for values in columns]
+            schema = pa.schema([pa.field(n, a.type) for n, a in zip(names, arrays)])
+        else:
+            arrays = [
+                _to_array(values, field.type) for values, field in zip(columns, schema)
+            ]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+    if schema is None:
+        yield pa.RecordBatch.from_arrays(
+            [pa.array([], type=pa.string()) for _ in names], names=names
+        )
+
+
+def arrow_chunks(result, export_format: str = "arrow") -> Iterator[bytes]:
+    """Yield ``result`` encoded as an Arrow IPC stream or a Parquet file."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    for batch in record_batches(result):
+        if writer is None:
+            out = pa.PythonFile(sink, mode="w")
+            if export_format == "parquet":
+                writer = pq.ParquetWriter(out, batch.schema)
+            else:
+                writer = pa.ipc.new_stream(out, batch.schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_response(
+    engine: Engine,
+    query: str,
+    filename: str,
+    export_format: str = "csv",
+    gzipped: bool = False,
+    timeout: Optional[float] = None,
+) -> Response:
+    """Return a streamed attachment of ``query`` in ``export_format``.
+
+    ``filename`` is given without extension. Raises ValueError for an unknown
+    format, ImportError if an Arrow format is requested without pyarrow and
+    QueryTimeout if the query runs out of its ``timeout`` before returning a
+    first row. ``timeout`` covers the time spent in the database, not waiting
+    on the client; running out later, or any other error while streaming,
+    ends the download with an error marker (see ``_error_marker``).
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f"Unknown export format {export_format!r}, "
+            f"expected one of {', '.join(EXPORT_FORMATS)}"
+        )
+    if export_format != "csv":
+        import pyarrow  # noqa: F401 - fail before running the query
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename += extension
+    started = time.monotonic()
+    conn, result = stream_query(engine, query, timeout)
+    if export_format == "csv":
+        chunks = csv_chunks(result)
+    else:
+        chunks = arrow_chunks(result, export_format)
+    chunks = _checked(chunks, conn, timeout, time.monotonic() - started, export_format)
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+        mimetype = "application/gzip"
+        filename += ".gz"
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.call_on_close(lambda: close_stream(conn))
+    return response
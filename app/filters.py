@@ -0,0 +1,106 @@
+"""Typed column filters for the DataTables per-column search boxes.
+
+A column search value is parsed with a small grammar and compiled to a
+predicate on the column's own type, instead of casting every row to text and
+matching ``LIKE '%value%'``, so the database can answer it from an index:
+
+- ``=value``: exact match
+- ``value*``: prefix match, compiled to a range (``col >= 'value' AND col <
+  'valuf'``) that a B-tree index can serve on any backend
+- ``>value``, ``>=value``, ``<value``, ``<=value``: comparisons
+- ``low..high``: inclusive range; either end may be left out
+- ``a,b,c``: any of the listed values
+
+A bare value is an exact match on numeric, boolean and date columns and a
+case-insensitive substring match (the old behaviour) on text columns. A value
+that is not valid for the column's type (e.g. ``>=abc`` on an integer column)
+matches no rows.
+"""
+
+import datetime
+import re
+from typing import Any, Callable
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, String
+from sqlalchemy import and_, cast, false, true
+from sqlalchemy.sql.elements import ColumnElement
+
+_COMPARISON = re.compile(r"^(>=|<=|>|<)\s*(.+)$")
+_BOOLEANS = {"true": True, "t": True, "1": True, "false": False, "f": False, "0": False}
+
+
+def _parse_bool(value: str) -> bool:
+    try:
+        return _BOOLEANS[value.lower()]
+    except KeyError:
+        raise ValueError(f"Invalid boolean: {value!r}") from None
+
+
+def _converter(col: ColumnElement) -> Callable[[str], Any]:
+    """Return a function turning search text into a value of ``col``'s type."""
+    col_type = col.type
+    if isinstance(col_type, Boolean):
+        return _parse_bool
+    if isinstance(col_type, Integer):
+        return int
+    if isinstance(col_type, (Float, Numeric)):
+        return float
+    if isinstance(col_type, DateTime):
+        return datetime.datetime.fromisoformat
+    if isinstance(col_type, Date):
+        return datetime.date.fromisoformat
+    return str
+
+
+def _prefix(col: ColumnElement, prefix: str) -> ColumnElement:
+    # Everything starting with the prefix sorts between it and its successor
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(col >= prefix, col < upper)
+
+
+def column_filter(col: ColumnElement, value: str) -> ColumnElement:
+    """Compile the column search ``value`` into a predicate on ``col``.
+
+    Parameters
+    ----------
+    col: sqlalchemy.sql.ColumnElement
+        Selected column to filter, possibly labelled.
+    value: str
+        Search text in the grammar described in the module docstring.
+    """
+    value = value.strip()
+    if not value:
+        return true()
+    convert = _converter(col)
+    is_text = convert is str
+
+    try:
+        if value.startswith("="):
+            return col == convert(value[1:].strip())
+        match = _COMPARISON.match(value)
+        if match:
+            op, operand = match.groups()
+            operand = convert(operand.strip())
+            return {
+                ">": col > operand,
+                ">=": col >= operand,
+                "<": col < operand,
+                "<=": col <= operand,
+            }[op]
+        if ".." in value:
+            low, high = (part.strip() for part in value.split("..", 1))
+            conditions = []
+            if low:
+                conditions.append(col >= convert(low))
+            if high:
+                conditions.append(col <= convert(high))
+            return and_(*conditions) if conditions else true()
+        if "," in value:
+            items = [item.strip() for item in value.split(",") if item.strip()]
+            return col.in_([convert(item) for item in items])
+        if is_text and value.endswith("*") and len(value) > 1:
+            return _prefix(col, value[:-1])
+        if is_text:
+            return cast(col, String).ilike(f"%{value}%")
+        return col == convert(value)
+    except ValueError:
+        return false()
@@ -0,0 +1,93 @@
+"""Conditional HTTP caching of pages and API responses.
+
+Detail pages and GET API responses only change when a new DB sync lands (or
+the app is upgraded), so they carry an ETag derived from the sync marker, the
+app version and the full request path, plus the database file's modification
+time as Last-Modified. A browser or proxy revalidating with
+``If-None-Match``/``If-Modified-Since`` gets a 304 before the view runs, so
+no database work is done for it.
+
+A view that renders a page before all of its data is ready (see
+``skip_validators``) gets no validators, so the incomplete page isn't kept
+until the next sync.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+from flask import Flask, Response, g, request
+from app import __version__, get_db_path, get_db_sync_marker
+from app.cache import make_key
+
+# GET endpoints whose responses depend on more than the database
+UNCACHEABLE_ENDPOINTS = {"api_nl_query_job", "api_species_tree"}
+
+
+def _is_cacheable() -> bool:
+    endpoint = request.endpoint or ""
+    return (
+        request.method == "GET"
+        and endpoint.startswith(("show_", "api_"))
+        and endpoint not in UNCACHEABLE_ENDPOINTS
+    )
+
+
+def _last_modified() -> Optional[datetime]:
+    db_path = get_db_path()
+    if db_path is None:
+        return None
+    try:
+        mtime = db_path.stat().st_mtime
+    except OSError:
+        return None
+    return datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+
+
+def skip_validators() -> None:
+    """Keep the response to the current request out of HTTP caches."""
+    g.skip_validators = True
+
+
+def init_app(app: Flask) -> None:
+    """Answer conditional GETs of cacheable endpoints with 304 Not Modified."""
+
+    @app.before_request
+    def check_not_modified():
+        if not _is_cacheable():
+            return None
+        marker = get_db_sync_marker()
+        if marker is None:
+            return None
+        g.etag = make_key(marker, __version__, request.full_path)[:32]
+        g.last_modified = _last_modified()
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(g.etag)
+        else:
+            since = request.if_modified_since
+            not_modified = (
+                since is not None
+                and g.last_modified is not None
+                and g.last_modified <= since
+            )
+        if not_modified:
+            response = Response(status=304)
+            _set_validators(response)
+            return response
+        return None
+
+    @app.after_request
+    def add_validators(response: Response) -> Response:
+        if g.get("skip_validators"):
+            response.cache_control.no_store = True
+        elif "etag" in g and response.status_code == 200:
+            _set_validators(response)
+        return response
+
+
+def _set_validators(response: Response) -> None:
+    # Weak, so the tag survives nginx compressing the response
+    response.set_etag(g.etag, weak=True)
+    if g.last_modified is not None:
+        response.last_modified = g.last_modified
+    # Caches may store the response but must revalidate it before reuse
+    response.cache_control.no_cache = True
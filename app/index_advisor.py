@@ -0,0 +1,218 @@
+"""Index advice for the browse tables.
+
+Browse tables are paged as ``ORDER BY <sort column>, <key> LIMIT n``, and the
+detail pages look rows up by the foreign keys joining isolates, assemblies and
+their results. Unless an index delivers rows in that order, SQLite reads the
+whole (joined) table into a temporary B-tree to sort it for every page, and a
+lookup by an unindexed foreign key scans its table. This module runs ``EXPLAIN
+QUERY PLAN`` for every sortable column of every browse query and for every
+foreign key lookup, reports the plans that sort in a temp B-tree or scan a
+table, and suggests the index that would avoid it.
+
+SQLite indexes have to live in the same file as their table and the web app
+opens the mARC database read-only, so suggested indexes are created on the
+database copy as part of the sync, before it is swapped in:
+
+    python -m app.index_advisor /path/to/db.sqlite --apply
+
+Environment variables:
+
+- MARC_INDEX_ADVISOR: print the report for the served database at startup
+  (default false)
+"""
+
+import os
+from typing import Optional
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Table, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.util import find_tables
+
+PAGE_LENGTH = 25
+
+
+def explain(engine: Engine, query: Select) -> list[str]:
+    """Return the detail lines of SQLite's query plan for ``query``."""
+    sql = query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    return [row[-1] for row in rows]
+
+
+def _is_full_scan(detail: str) -> bool:
+    return detail.startswith("SCAN ") and "INDEX" not in detail
+
+
+def _table_column(col) -> Optional[Column]:
+    """Return the table column behind a (possibly labelled) selected column."""
+    col = getattr(col, "element", col)
+    if isinstance(col, Column) and isinstance(col.table, Table):
+        return col
+    return None
+
+
+def index_statement(table: str, columns: tuple[str, ...]) -> str:
+    return (
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_{'_'.join(columns)} "
+        f"ON {table} ({', '.join(columns)})"
+    )
+
+
+def _sort_index(sort_col, key) -> Optional[tuple[str, tuple[str, ...]]]:
+    column = _table_column(sort_col)
+    if column is None:
+        return None
+    columns = [column.name]
+    key_column = _table_column(key) if key is not None else None
+    if key_column is not None and key_column.table is column.table:
+        if key_column is not column:
+            columns.append(key_column.name)
+    return column.table.name, tuple(columns)
+
+
+def advise(engine: Engine, queries: dict) -> list[dict]:
+    """Return a finding for each plan that sorts in a temp B-tree or scans.
+
+    Parameters
+    ----------
+    engine: sqlalchemy.engine.Engine
+        Engine of the SQLite database to check.
+    queries: dict
+        Browse queries as ``{name: (select, key)}``, where ``key`` is the
+        unique column the table is ordered by after the sort column (or None).
+
+    Each finding has the ``query`` name, what was checked (``check``), the
+    offending ``plan`` lines and the ``index`` that should help, as a table
+    name and column names (or None). Sorts by a column of a joined table that
+    only need a temp B-tree to order rows with equal values by ``key`` ("RIGHT
+    PART OF ORDER BY") are reported without an index, as no single index
+    can deliver that order.
+    """
+    findings = []
+    tables = {}
+    for name, (query, key) in queries.items():
+        key = key.expression if hasattr(key, "expression") else key
+        for sort_col in query.selected_columns:
+            order = (
+                [sort_col] if key is None or sort_col.compare(key) else [sort_col, key]
+            )
+            page = query.order_by(None).order_by(*order).limit(PAGE_LENGTH)
+            plan = explain(engine, page)
+            temp_sorts = [d for d in plan if "TEMP B-TREE" in d]
+            if temp_sorts:
+                findings.append(
+                    {
+                        "query": name,
+                        "check": f"sort by {sort_col.key}",
+                        "plan": temp_sorts,
+                        "index": (
+                            None
+                            if all("RIGHT PART" in d for d in temp_sorts)
+                            else _sort_index(sort_col, key)
+                        ),
+                    }
+                )
+        for table in find_tables(query, include_joins=False):
+            tables[table.name] = table
+
+    # Detail pages and joins look child rows up by their foreign keys
+    for table in tables.values():
+        for fk in table.foreign_keys:
+            column = fk.parent
+            if column.primary_key:
+                continue
+            plan = explain(engine, select(table).where(column == 1))
+            scans = [d for d in plan if _is_full_scan(d)]
+            if scans:
+                findings.append(
+                    {
+                        "query": table.name,
+                        "check": f"lookup by {column.name}",
+                        "plan": scans,
+                        "index": (table.name, (column.name,)),
+                    }
+                )
+    return findings
+
+
+def report(findings: list[dict]) -> str:
+    if not findings:
+        return "Index advisor: every browse sort and foreign key lookup uses an index"
+    lines = [f"Index advisor: {len(findings)} plan(s) without a supporting index"]
+    for finding in findings:
+        lines.append(
+            f"  {finding['query']}, {finding['check']}: {'; '.join(finding['plan'])}"
+        )
+    indexes = suggested_indexes(findings)
+    if indexes:
+        lines.append("Suggested indexes:")
+        lines.extend(f"  {statement};" for statement in indexes)
+    return "\n".join(lines)
+
+
+def suggested_indexes(findings: list[dict]) -> list[str]:
+    """Return CREATE INDEX statements for the findings' indexes.
+
+    An index whose columns lead another suggested index on the same table is
+    left out, since the longer index serves its queries too.
+    """
+    indexes = list(dict.fromkeys(f["index"] for f in findings if f["index"]))
+    return [
+        index_statement(table, columns)
+        for table, columns in indexes
+        if not any(
+            other_table == table
+            and len(other) > len(columns)
+            and other[: len(columns)] == columns
+            for other_table, other in indexes
+        )
+    ]
+
+
+def apply_indexes(engine: Engine, statements: list[str]) -> None:
+    """Create the indexes and refresh the planner's statistics."""
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+        conn.execute(text("ANALYZE"))
+
+
+def init_app(database: SQLAlchemy, queries: dict) -> None:
+    """Print the index report for the served database if MARC_INDEX_ADVISOR is set."""
+    if os.environ.get("MARC_INDEX_ADVISOR", "false").lower() != "true":
+        return
+    if database.engine.dialect.name != "sqlite":
+        return
+    try:
+        print(report(advise(database.engine, queries)))
+    except Exception as e:
+        print(f"Error running index advisor: {e}")
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(
+        description="Report (and create) indexes missing for the browse tables"
+    )
+    parser.add_argument("db", type=Path, help="mARC SQLite database")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Create the suggested indexes in the database",
+    )
+    args = parser.parse_args()
+
+    # The browse queries are defined with the app, which needs a database
+    os.environ.setdefault("MARC_DB_URL", f"sqlite:///{args.db.resolve()}")
+    from app.app import BROWSE_QUERIES
+
+    engine = create_engine(f"sqlite:///{args.db.resolve()}")
+    findings = advise(engine, BROWSE_QUERIES)
+    print(report(findings))
+    if args.apply and suggested_indexes(findings):
+        apply_indexes(engine, suggested_indexes(findings))
+        print(report(advise(engine, BROWSE_QUERIES)))
@@ -0,0 +1,134 @@
+"""Per-request timing of SQL statements and response phases.
+
+Every SQL statement is timed through SQLAlchemy's cursor execution events, and
+code can time named phases of a request with ``timed``. Both are reported to
+the browser in a ``Server-Timing`` header (visible in the network panel of the
+developer tools), statements slower than MARC_SLOW_QUERY_MS (default 500) are
+logged with their parameters, and request latencies are kept in per-endpoint
+histograms for the lifetime of the worker. Statement and request timings are
+also exported to ``/metrics`` (see ``app.metrics``).
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Flask, Response, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from app.metrics import LATENCY_BUCKETS, observe_request, observe_statement
+
+
+class LatencyHistogram:
+    """Counts of observed latencies per bucket, plus their count and sum."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is for observations above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+_histograms: dict[str, LatencyHistogram] = {}
+_histograms_lock = threading.Lock()
+
+
+def observe_latency(endpoint: str, seconds: float) -> None:
+    with _histograms_lock:
+        histogram = _histograms.get(endpoint)
+        if histogram is None:
+            histogram = _histograms[endpoint] = LatencyHistogram()
+        histogram.observe(seconds)
+
+
+def latency_histograms() -> dict:
+    """Return a snapshot of this worker's per-endpoint latency histograms."""
+    with _histograms_lock:
+        return {name: h.snapshot() for name, h in _histograms.items()}
+
+
+def slow_query_threshold() -> float:
+    return float(os.environ.get("MARC_SLOW_QUERY_MS", 500)) / 1000
+
+
+@contextmanager
+def timed(name: str):
+    """Record the duration of the block as ``name`` in the Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and "timings" in g:
+            g.timings.append((name, time.perf_counter() - start))
+
+
+def server_timing(timings, sql_count: int, sql_time: float, total: float) -> str:
+    """Render phase durations (in seconds) as a Server-Timing header value."""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    entries.append(f'db;dur={sql_time * 1000:.1f};desc="{sql_count} statements"')
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def init_app(app: Flask, database: SQLAlchemy) -> None:
+    """Time SQL statements on ``database`` and requests to ``app``."""
+    engine = database.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+        endpoint = "background"
+        if has_request_context():
+            endpoint = request.endpoint or "unknown"
+            if "sql_count" in g:
+                g.sql_count += 1
+                g.sql_time += elapsed
+        observe_statement(endpoint, elapsed)
+        if elapsed >= slow_query_threshold():
+            print(f"Slow query ({elapsed * 1000:.1f} ms): {statement} {parameters!r}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.execution_context is not None:
+            starts = context.connection.info.get("query_start_time")
+            if starts:
+                starts.pop()
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.timings = []
+        g.sql_count = 0
+        g.sql_time = 0.0
+
+    @app.after_request
+    def add_server_timing(response: Response) -> Response:
+        if "request_start" not in g:
+            return response
+        total = time.perf_counter() - g.request_start
+        response.headers["Server-Timing"] = server_timing(
+            g.timings, g.sql_count, g.sql_time, total
+        )
+        endpoint = request.endpoint or "unknown"
+        observe_latency(endpoint, total)
+        observe_request(endpoint, request.method, response.status_code, total)
+        return response
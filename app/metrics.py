@@ -0,0 +1,109 @@
+"""Prometheus metrics for the ``/metrics`` endpoint.
+
+Under gunicorn every worker keeps its own metric values, so the
+multiprocess mode of prometheus_client is used whenever
+PROMETHEUS_MULTIPROC_DIR is set: each worker writes its values to files in
+that directory and ``/metrics`` aggregates the files of all workers, no
+matter which worker serves the scrape. The directory must exist and be empty
+when gunicorn starts (see gunicorn.conf.py). Without it, e.g. under the flask
+dev server, the metrics of the single process are exported.
+"""
+
+import os
+from flask import Response
+from flask_sqlalchemy import SQLAlchemy
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # With --preload the app is imported before gunicorn's on_starting hook
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUESTS = Counter(
+    "marc_http_requests_total",
+    "HTTP requests handled",
+    ["endpoint", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "marc_http_request_duration_seconds",
+    "Time to handle an HTTP request, excluding streamed bodies",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+SQL_STATEMENTS = Counter(
+    "marc_sql_statements_total", "SQL statements executed", ["endpoint"]
+)
+SQL_LATENCY = Histogram(
+    "marc_sql_statement_duration_seconds",
+    "Time to execute a SQL statement",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_CONNECTIONS_OPENED = Counter(
+    "marc_db_connections_opened_total", "Database connections opened"
+)
+DB_CONNECTIONS_CLOSED = Counter(
+    "marc_db_connections_closed_total", "Database connections closed"
+)
+LLM_LATENCY = Histogram(
+    "marc_llm_call_duration_seconds",
+    "Time for the LLM to generate SQL for a natural language question",
+    ["operation"],
+    buckets=LLM_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "marc_cache_lookups_total", "Shared cache lookups", ["cache", "result"]
+)
+
+
+def init_app(database: SQLAlchemy) -> None:
+    """Count connections opened and closed by ``database``'s engine."""
+    engine = database.engine
+
+    @event.listens_for(engine, "connect")
+    def count_connect(_dbapi_connection, _connection_record):
+        DB_CONNECTIONS_OPENED.inc()
+
+    @event.listens_for(engine, "close")
+    def count_close(_dbapi_connection, _connection_record):
+        DB_CONNECTIONS_CLOSED.inc()
+
+    @event.listens_for(engine, "close_detached")
+    def count_close_detached(_dbapi_connection):
+        DB_CONNECTIONS_CLOSED.inc()
+
+
+def observe_request(endpoint: str, method: str, status: int, seconds: float) -> None:
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+    REQUEST_LATENCY.labels(endpoint).observe(seconds)
+
+
+def observe_statement(endpoint: str, seconds: float) -> None:
+    SQL_STATEMENTS.labels(endpoint).inc()
+    SQL_LATENCY.labels(endpoint).observe(seconds)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def metrics_response() -> Response:
+    """Return all metrics in the Prometheus text exposition format."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
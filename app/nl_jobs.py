@@ -0,0 +1,95 @@
+"""Background jobs for natural language query generation.
+
+Generating SQL with the LLM takes several seconds, which would tie up one of
+the few synchronous gunicorn workers for the whole round trip. Instead, a
+request submits a job and gets its id back immediately; the model is called
+from a small per-process thread pool, and the job's state is kept in the
+shared cache so that a poll handled by any worker can see the result.
+
+Environment variables:
+
+- MARC_NL_MAX_CONCURRENCY: LLM calls run at once per worker (default 2)
+- MARC_NL_JOB_TIMEOUT: seconds before an unfinished job is reported as failed
+  (default 300), e.g. because the worker running it was restarted
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.cache import SharedCache
+
+PENDING = "pending"
+DONE = "done"
+ERROR = "error"
+
+_jobs = SharedCache("nl_jobs", max_entries=1024, ttl=60 * 60)
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _job_timeout() -> float:
+    return float(os.environ.get("MARC_NL_JOB_TIMEOUT", 300))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Threads do not survive gunicorn's fork, so each worker starts its own pool
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("MARC_NL_MAX_CONCURRENCY", 2)),
+                thread_name_prefix="nl_query",
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run(job_id: str, question: str, starting_query: Optional[str]) -> None:
+    from app.nl_query import generate_sql, generate_sql_modification
+
+    job = _jobs.get(job_id) or {"created": time.time()}
+    try:
+        if starting_query:
+            query = generate_sql_modification(question, starting_query)
+        else:
+            query = generate_sql(question)
+        job.update(status=DONE, query=query)
+    except Exception as e:
+        print(f"Error creating NL query: {e}")
+        job.update(status=ERROR, error="Query generation failed")
+    _jobs.set(job_id, job)
+
+
+def submit(question: str, starting_query: Optional[str] = None) -> str:
+    """Start generating SQL for ``question`` and return the job id.
+
+    Questions that have been answered before complete immediately from the
+    SQL cache without using a thread.
+    """
+    from app.nl_query import lookup_sql
+
+    job_id = uuid.uuid4().hex
+    job = {"status": PENDING, "created": time.time()}
+    query = lookup_sql(question, starting_query)
+    if query is not None:
+        job.update(status=DONE, query=query)
+        _jobs.set(job_id, job)
+        return job_id
+
+    _jobs.set(job_id, job)
+    _get_executor().submit(_run, job_id, question, starting_query)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    """Return ``{"status", "query" | "error"}`` for a job, or None if unknown."""
+    job = _jobs.get(job_id)
+    if job is None:
+        return None
+    if job["status"] == PENDING and time.time() - job["created"] > _job_timeout():
+        return {"status": ERROR, "error": "Query generation timed out"}
+    return {k: v for k, v in job.items() if k != "created"}
@@ -1,17 +1,21 @@
-"""Utilities for generating SQL from natural language prompts."""
+"""Utilities for generating SQL from natural language prompts.
 
-from typing import Optional
+The langchain/langgraph stack is only imported, and the LLM client, prompt
+and compiled graphs only built, on first use; they are then reused for every
+later question. Importing this module is cheap so the web app can import it
+without slowing down worker startup.
+"""
 
-from typing_extensions import Annotated, TypedDict
+import functools
+import hashlib
+import os
+from typing import Callable, Optional
 
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langgraph.graph import START, StateGraph
-from sqlalchemy.dialects import sqlite
-from sqlalchemy.schema import CreateTable
+from typing_extensions import Annotated, TypedDict
 
-# Import SQLAlchemy models installed via requirements
-from marc_db.models import Base
+from app.cache import SharedCache, make_key
+from app.metrics import LLM_LATENCY
+from app.results import normalize_sql
 
 
 class QueryOutput(TypedDict):
@@ -26,10 +30,38 @@ class State(TypedDict):
     initial_query: Optional[str] = None
 
 
-# Build schema from SQLAlchemy models
-SCHEMA = "\n\n".join(
-    str(CreateTable(table).compile(dialect=sqlite.dialect()))
-    for table in Base.metadata.sorted_tables
+@functools.cache
+def get_schema() -> str:
+    """Build the schema description from the SQLAlchemy models."""
+    from sqlalchemy.dialects import sqlite
+    from sqlalchemy.schema import CreateTable
+
+    # Import SQLAlchemy models installed via requirements
+    from marc_db.models import Base
+
+    return "\n\n".join(
+        str(CreateTable(table).compile(dialect=sqlite.dialect()))
+        for table in Base.metadata.sorted_tables
+    )
+
+
+@functools.cache
+def schema_hash() -> str:
+    """Cached SQL is tied to the schema it was generated against."""
+    return hashlib.sha256(get_schema().encode("utf-8")).hexdigest()
+
+
+def __getattr__(name):
+    if name == "SCHEMA":
+        return get_schema()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Generated SQL is shared by all workers and persists across restarts
+_sql_cache = SharedCache(
+    "nl_query",
+    max_entries=int(os.environ.get("MARC_NL_CACHE_SIZE", 1000)),
+    ttl=float(os.environ.get("MARC_NL_CACHE_TTL", 7 * 24 * 60 * 60)),
 )
 
 QUERY_SYSTEM_PROMPT = """
@@ -46,12 +78,18 @@ Existing query draft (may be empty):
 {existing_query}
 """
 
-query_prompt_template = ChatPromptTemplate.from_messages(
-    [
-        ("system", QUERY_SYSTEM_PROMPT),
-        ("human", "{input}"),
-    ]
-)
+
+@functools.cache
+def get_query_prompt_template():
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", QUERY_SYSTEM_PROMPT),
+            ("human", "{input}"),
+        ]
+    )
+
 
 GENERATE_QUERY_PROMPT = lambda user_input: f"""
 ``` SYSTEM
@@ -62,7 +100,7 @@ Pay attention to use only the column names that you can see in the schema descri
 do not exist. Also, pay attention to which column is in which table.
 
 Only use the following tables:
-{SCHEMA}
+{get_schema()}
 ```
 
 ``` USER
@@ -70,55 +108,106 @@ Only use the following tables:
 ```
 """
 
-llm = ChatOpenAI(
-    model="gpt-4o",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
+
+@functools.cache
+def get_llm():
+    """Return the LLM client, configured to return a ``QueryOutput``."""
+    from langchain_openai import ChatOpenAI
+
+    llm = ChatOpenAI(
+        model="gpt-4o",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+    )
+    return llm.with_structured_output(QueryOutput)
 
 
 def write_query(state: State) -> State:
     prompt = GENERATE_QUERY_PROMPT(state["question"])
-    structured_llm = llm.with_structured_output(QueryOutput)
-    result = structured_llm.invoke(prompt)
+    result = get_llm().invoke(prompt)
     return {"query": result["query"]}
 
 
 def modify_query(state: State) -> State:
-    prompt = query_prompt_template.invoke(
+    prompt = get_query_prompt_template().invoke(
         {
             "dialect": "sqlite",
             "top_k": 10,
-            "table_info": SCHEMA,
+            "table_info": get_schema(),
             "existing_query": state["query"],
             "input": state["question"],
         }
     )
-    structured_llm = llm.with_structured_output(QueryOutput)
-    result = structured_llm.invoke(prompt)
+    result = get_llm().invoke(prompt)
     return {"query": result["query"]}
 
 
-def generate_sql(question: str) -> str:
+_NODES = {"write_query": write_query, "modify_query": modify_query}
+
+
+@functools.cache
+def get_graph(node: str):
+    """Return the compiled single-node graph that runs ``node``."""
+    from langgraph.graph import START, StateGraph
+
     graph_builder = StateGraph(State)
-    graph_builder.add_node("write_query", write_query)
-    graph_builder.add_edge(START, "write_query")
-    graph = graph_builder.compile()
-    result = graph.invoke({"question": question})
+    graph_builder.add_node(node, _NODES[node])
+    graph_builder.add_edge(START, node)
+    return graph_builder.compile()
+
+
+def normalize_question(question: str) -> str:
+    """Collapse whitespace and drop trailing punctuation from a question."""
+    return " ".join(question.split()).rstrip("?!. ")
+
+
+def _sql_key(question: str, starting_query: Optional[str]) -> str:
+    return make_key(
+        normalize_question(question),
+        normalize_sql(starting_query or ""),
+        schema_hash(),
+    )
+
+
+def _cached_sql(
+    question: str, starting_query: Optional[str], generate: Callable[[], str]
+) -> str:
+    return _sql_cache.get_or_set(_sql_key(question, starting_query), generate)
+
+
+def lookup_sql(question: str, starting_query: Optional[str] = None) -> Optional[str]:
+    """Return previously generated SQL for ``question``, without calling the model."""
+    return _sql_cache.get(_sql_key(question, starting_query))
+
+
+def _generate_sql(question: str) -> str:
+    with LLM_LATENCY.labels("generate").time():
+        result = get_graph("write_query").invoke({"question": question})
     return result["query"]
 
 
-def generate_sql_modification(question: str, starting_query: str) -> str:
-    graph_builder = StateGraph(State)
-    graph_builder.add_node("modify_query", modify_query)
-    graph_builder.add_edge(START, "modify_query")
-    graph = graph_builder.compile()
-    result = graph.invoke({"question": question, "query": starting_query})
+def _generate_sql_modification(question: str, starting_query: str) -> str:
+    with LLM_LATENCY.labels("modify").time():
+        result = get_graph("modify_query").invoke(
+            {"question": question, "query": starting_query}
+        )
     return result["query"]
 
 
+def generate_sql(question: str) -> str:
+    return _cached_sql(question, None, lambda: _generate_sql(question))
+
+
+def generate_sql_modification(question: str, starting_query: str) -> str:
+    return _cached_sql(
+        question,
+        starting_query,
+        lambda: _generate_sql_modification(question, starting_query),
+    )
+
+
 if __name__ == "__main__":
     import argparse
 
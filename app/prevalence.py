@@ -0,0 +1,219 @@
+"""Prevalence of AMR genes by species and special collection.
+
+Answering "which resistance genes are common in which species" takes a join
+of antimicrobials, assemblies, taxonomic assignments and isolates grouped by
+gene, which scans the largest table in the database. Instead, the counts are
+aggregated once per DB sync (and taxonomic tool) and kept in the shared
+cache: the number of assemblies of each species and special collection, and
+the number of those carrying each gene. Prevalence matrices are then
+filtered, rolled up and served from the cached counts.
+
+The species and antimicrobial pages don't wait for the counts: after a new
+sync, the first page view starts building them in a background thread, in
+only one worker, and the pages leave out their prevalence section until the
+counts are ready.
+"""
+
+import os
+import threading
+from typing import Optional
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from marc_db.models import Antimicrobial, Assembly, Isolate, TaxonomicAssignment
+from sqlalchemy import func, select
+from app import get_db_sync_marker
+from app.cache import SharedCache, make_key
+from app.stats import UNKNOWN_SPECIES
+
+COLUMNS = [
+    "gene_symbol",
+    "element_type",
+    "species",
+    "special_collection",
+    "assemblies",
+    "total",
+    "prevalence",
+]
+
+# Seconds after which an unfinished build is assumed dead and may be retried
+BUILD_TIMEOUT = 600
+
+_prevalence_cache = SharedCache("prevalence", max_entries=16)
+# Claims on the builds in progress, so only one worker runs each
+_build_claims = SharedCache("prevalence_builds", max_entries=16, ttl=BUILD_TIMEOUT)
+_building = threading.Lock()
+
+
+def compute_counts(database: SQLAlchemy, tool: str = "sylph") -> dict:
+    """Count assemblies per species and collection, in total and per gene.
+
+    Returns ``{"totals": [[species, collection, n], ...], "genes":
+    [[gene_symbol, element_type, species, collection, n], ...]}``, where an
+    assembly's species is the classification assigned by ``tool``.
+    """
+    species = func.coalesce(TaxonomicAssignment.classification, UNKNOWN_SPECIES)
+    base = (
+        select(
+            Assembly.id.label("assembly_id"),
+            species.label("species"),
+            Isolate.special_collection,
+        )
+        .join(TaxonomicAssignment, Assembly.id == TaxonomicAssignment.assembly_id)
+        .outerjoin(Isolate, Assembly.isolate_id == Isolate.sample_id)
+        .where(TaxonomicAssignment.tool == tool)
+        .subquery()
+    )
+    totals = database.session.execute(
+        select(
+            base.c.species,
+            base.c.special_collection,
+            func.count(base.c.assembly_id.distinct()),
+        ).group_by(base.c.species, base.c.special_collection)
+    ).all()
+    genes = database.session.execute(
+        select(
+            Antimicrobial.gene_symbol,
+            Antimicrobial.element_type,
+            base.c.species,
+            base.c.special_collection,
+            func.count(Antimicrobial.assembly_id.distinct()),
+        )
+        .join(base, Antimicrobial.assembly_id == base.c.assembly_id)
+        .where(Antimicrobial.gene_symbol.isnot(None))
+        .group_by(
+            Antimicrobial.gene_symbol,
+            Antimicrobial.element_type,
+            base.c.species,
+            base.c.special_collection,
+        )
+    ).all()
+    return {"totals": [list(r) for r in totals], "genes": [list(r) for r in genes]}
+
+
+def prevalence_counts(database: SQLAlchemy, tool: str = "sylph") -> dict:
+    """Return ``compute_counts(tool)``, cached until the next DB sync."""
+    marker = get_db_sync_marker()
+    if marker is None:
+        return compute_counts(database, tool)
+    return _prevalence_cache.get_or_set(
+        make_key(marker, tool), lambda: compute_counts(database, tool)
+    )
+
+
+def build_counts(app: Flask, database: SQLAlchemy, key: str, tool: str) -> None:
+    """Compute and store the counts of ``tool`` under ``key``."""
+    try:
+        with app.app_context():
+            counts = compute_counts(database, tool)
+        _prevalence_cache.set(key, counts)
+    except Exception as e:
+        print(f"Error building AMR prevalence counts: {e}")
+
+
+def _build_in_background(app: Flask, database: SQLAlchemy, key: str, tool: str) -> None:
+    if not _building.acquire(blocking=False):
+        return
+    if not _build_claims.add(key, os.getpid()):
+        _building.release()
+        return
+
+    def run():
+        try:
+            build_counts(app, database, key, tool)
+        finally:
+            _building.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def ready_counts(
+    app: Flask, database: SQLAlchemy, tool: str = "sylph"
+) -> Optional[dict]:
+    """Return ``prevalence_counts(tool)`` if it is ready, without waiting for it.
+
+    Returns None, and starts building the counts in the background, when
+    they haven't been computed for the current DB sync yet. Without a sync
+    marker the counts are computed directly.
+    """
+    marker = get_db_sync_marker()
+    if marker is None:
+        return compute_counts(database, tool)
+    key = make_key(marker, tool)
+    counts = _prevalence_cache.get(key)
+    if counts is None:
+        _build_in_background(app, database, key, tool)
+    return counts
+
+
+def prevalence_rows(
+    counts: dict,
+    gene: Optional[str] = None,
+    element_type: Optional[str] = None,
+    species: Optional[str] = None,
+    collection: Optional[str] = None,
+    by_collection: bool = True,
+    min_assemblies: int = 1,
+) -> list[list]:
+    """Return rows of the prevalence matrix, in the order of ``COLUMNS``.
+
+    Rows are sorted by species, then by descending prevalence. With
+    ``by_collection=False`` the special collections of each species are added
+    up, and ``special_collection`` is None.
+    """
+
+    def group(row_species, row_collection):
+        return (row_species, row_collection if by_collection else None)
+
+    def keep(row_species, row_collection):
+        return (species is None or row_species == species) and (
+            collection is None or row_collection == collection
+        )
+
+    totals = {}
+    for row_species, row_collection, n in counts["totals"]:
+        if keep(row_species, row_collection):
+            key = group(row_species, row_collection)
+            totals[key] = totals.get(key, 0) + n
+
+    carriers = {}
+    for symbol, row_element, row_species, row_collection, n in counts["genes"]:
+        if gene is not None and symbol != gene:
+            continue
+        if element_type is not None and row_element != element_type:
+            continue
+        if keep(row_species, row_collection):
+            key = (symbol, row_element) + group(row_species, row_collection)
+            carriers[key] = carriers.get(key, 0) + n
+
+    rows = []
+    for (symbol, row_element, row_species, row_collection), n in carriers.items():
+        if n < min_assemblies:
+            continue
+        total = totals[(row_species, row_collection)]
+        rows.append(
+            [symbol, row_element, row_species, row_collection, n, total, n / total]
+        )
+    rows.sort(key=lambda r: (r[2], r[3] or "", -r[6], r[0]))
+    return rows
+
+
+def arrow_stream(rows: list[list]) -> bytes:
+    """Encode prevalence rows as an Arrow IPC stream (requires pyarrow)."""
+    import pyarrow as pa
+
+    schema = pa.schema(
+        [
+            ("gene_symbol", pa.string()),
+            ("element_type", pa.string()),
+            ("species", pa.string()),
+            ("special_collection", pa.string()),
+            ("assemblies", pa.int64()),
+            ("total", pa.int64()),
+            ("prevalence", pa.float64()),
+        ]
+    )
+    table = pa.Table.from_pylist([dict(zip(COLUMNS, r)) for r in rows], schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
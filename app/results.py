@@ -0,0 +1,208 @@
+"""Materialized results of ad-hoc SQL for the query page.
+
+The query page's DataTable posts the same SQL to ``/api/query`` for every
+page, sort and search change, and each of those requests would otherwise
+evaluate the user's query several times (columns, total count, filtered
+count, page). Instead, the result of a query is materialized once into a
+table of a side database (``results.sqlite`` in the shared cache directory),
+keyed on the normalized SQL and the DB sync marker. The side database is
+attached to every SQLite connection as ``marc_results``, so later requests
+page, sort and filter the materialized table instead of the original query.
+
+Environment variables:
+
+- MARC_RESULT_CACHE_MAX_ROWS: results with more rows than this are not
+  materialized (default 200,000)
+- MARC_RESULT_CACHE_TOTAL_ROWS: least recently used results are dropped once
+  the materialized results hold more rows than this in total (default 2,000,000)
+"""
+
+import os
+import re
+import sqlite3
+import time
+from typing import Optional
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from app import get_db_sync_marker
+from app.cache import cache_dir, make_key
+from app.timeouts import is_timeout
+
+SCHEMA = "marc_results"
+BATCH_SIZE = 5000
+# result_meta row count of a result that was too large to materialize
+OVERSIZED = -1
+
+
+def results_path():
+    return cache_dir() / "results.sqlite"
+
+
+def init_app(database: SQLAlchemy) -> None:
+    """Attach the results database to every new SQLite connection."""
+    engine = database.engine
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def attach_results(dbapi_connection, _connection_record):
+        try:
+            dbapi_connection.execute(
+                f"ATTACH DATABASE ? AS {SCHEMA}", (str(results_path()),)
+            )
+        except sqlite3.Error as e:
+            print(f"Error attaching results cache: {e}")
+
+
+# Quoted strings and identifiers, whose whitespace is significant, and
+# comments, since the newline ending a line comment is what ends it
+_VERBATIM = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*(?:\n|$)|/\*.*?(?:\*/|$))""",
+    re.DOTALL,
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace outside quotes and comments, drop trailing semicolons."""
+    parts = _VERBATIM.split(sql)
+    parts[::2] = [re.sub(r"\s+", " ", part) for part in parts[::2]]
+    return "".join(parts).strip().rstrip("; ")
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(results_path(), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS result_meta "
+        "(name TEXT PRIMARY KEY, row_count INTEGER NOT NULL, accessed REAL NOT NULL)"
+    )
+    return conn
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _evict(conn: sqlite3.Connection, keep: str) -> None:
+    """Drop least recently used results beyond the total row budget."""
+    budget = int(os.environ.get("MARC_RESULT_CACHE_TOTAL_ROWS", 2_000_000))
+    rows = conn.execute(
+        "SELECT name, row_count FROM result_meta ORDER BY accessed DESC"
+    ).fetchall()
+    total = 0
+    for name, row_count in rows:
+        total += max(row_count, 0)
+        if total > budget and name != keep:
+            with conn:
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                conn.execute("DELETE FROM result_meta WHERE name = ?", (name,))
+
+
+def _materialize(database: SQLAlchemy, sql: str, name: str) -> bool:
+    """Copy the rows of ``sql`` into the table ``name``.
+
+    Returns False if the result has too many rows, leaving behind only an
+    OVERSIZED entry in result_meta so the query isn't tried again.
+    """
+    max_rows = int(os.environ.get("MARC_RESULT_CACHE_MAX_ROWS", 200_000))
+    result = database.session.execute(
+        # On its own line, so a trailing line comment can't swallow it
+        text(f"SELECT * FROM ({sql}\n) AS q"),
+        execution_options={"stream_results": True, "yield_per": BATCH_SIZE},
+    )
+    columns = list(result.keys())
+    staging = f"{name}_{os.getpid()}"
+    placeholders = ", ".join("?" * len(columns))
+    conn = _connect()
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {staging}")
+        conn.execute(
+            f"CREATE TABLE {staging} ({', '.join(_quote(c) for c in columns)})"
+        )
+        row_count = 0
+        for rows in result.partitions(BATCH_SIZE):
+            row_count += len(rows)
+            if row_count > max_rows:
+                result.close()
+                conn.rollback()
+                with conn:
+                    conn.execute(f"DROP TABLE IF EXISTS {staging}")
+                    conn.execute(
+                        "INSERT OR REPLACE INTO result_meta VALUES (?, ?, ?)",
+                        (name, OVERSIZED, time.time()),
+                    )
+                return False
+            conn.executemany(
+                f"INSERT INTO {staging} VALUES ({placeholders})",
+                [tuple(r) for r in rows],
+            )
+        conn.commit()
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+            conn.execute(f"ALTER TABLE {staging} RENAME TO {name}")
+            conn.execute(
+                "INSERT OR REPLACE INTO result_meta VALUES (?, ?, ?)",
+                (name, row_count, time.time()),
+            )
+        _evict(conn, keep=name)
+    except Exception:
+        conn.rollback()
+        conn.execute(f"DROP TABLE IF EXISTS {staging}")
+        raise
+    finally:
+        conn.close()
+    return True
+
+
+def _touch(name: str) -> Optional[int]:
+    """Mark the result ``name`` as used, returning its row count.
+
+    Returns None if it hasn't been materialized, and OVERSIZED if it was too
+    large to be.
+    """
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE result_meta SET accessed = ? WHERE name = ?",
+                (time.time(), name),
+            )
+            row = conn.execute(
+                "SELECT row_count FROM result_meta WHERE name = ?", (name,)
+            ).fetchone()
+    finally:
+        conn.close()
+    return None if row is None else row[0]
+
+
+def cached_query(database: SQLAlchemy, sql: str) -> Optional[str]:
+    """Return SQL selecting the materialized result of ``sql``.
+
+    The result is materialized on first use. Returns None when it cannot be
+    (non-SQLite backend, no sync marker, an invalid or oversized result);
+    callers should run ``sql`` itself in that case. Timeouts are re-raised.
+    """
+    if database.engine.dialect.name != "sqlite":
+        return None
+    marker = get_db_sync_marker()
+    if marker is None:
+        return None
+
+    # Only the key is normalized; the query is run exactly as written
+    name = "r_" + make_key(marker, normalize_sql(sql))[:32]
+    sql = sql.strip().rstrip("; \t\r\n")
+    try:
+        row_count = _touch(name)
+        if row_count == OVERSIZED:
+            return None
+        if row_count is None and not _materialize(database, sql, name):
+            return None
+    except DBAPIError as e:
+        if is_timeout(e):
+            raise
+        return None
+    except sqlite3.Error as e:
+        print(f"Error materializing query result: {e}")
+        return None
+    return f"SELECT * FROM {SCHEMA}.{name}"
@@ -0,0 +1,170 @@
+"""Full-text search index backing the DataTables global search box.
+
+Global search over a browse endpoint otherwise has to ``LIKE '%term%'`` every
+selected column of every row. Instead, each registered endpoint gets an FTS5
+trigram table in a side database (``search.sqlite`` in the shared cache
+directory) holding the endpoint's key and the text of each selected column.
+The side database is attached to every SQLite connection as ``marc_search``,
+so search becomes ``key IN (SELECT key FROM marc_search.<name>(:term))``.
+
+Indexes are rebuilt in a background thread the first time they are used after
+a new DB sync lands; until then, searches fall back to LIKE.
+"""
+
+import fcntl
+import sqlite3
+import threading
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import cast, column, event, String, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+from app import get_db_sync_marker
+from app.cache import cache_dir, make_key
+
+SCHEMA = "marc_search"
+# Trigram indexes can only answer searches of at least this many characters
+MIN_TERM_LENGTH = 3
+BATCH_SIZE = 5000
+
+_building: set[str] = set()
+_building_lock = threading.Lock()
+
+
+def index_path():
+    return cache_dir() / "search.sqlite"
+
+
+def init_app(database: SQLAlchemy) -> None:
+    """Attach the search database to every new SQLite connection."""
+    engine = database.engine
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def attach_search_index(dbapi_connection, _connection_record):
+        try:
+            dbapi_connection.execute(
+                f"ATTACH DATABASE ? AS {SCHEMA}", (str(index_path()),)
+            )
+        except sqlite3.Error as e:
+            print(f"Error attaching search index: {e}")
+
+
+def _index_version(query: Select) -> str:
+    """Identify the indexed columns so a changed endpoint query forces a rebuild."""
+    return make_key(get_db_sync_marker(), [str(c) for c in query.selected_columns])
+
+
+def _indexed_version(name: str):
+    try:
+        conn = sqlite3.connect(index_path(), timeout=5)
+        try:
+            row = conn.execute(
+                "SELECT version FROM index_meta WHERE name = ?", (name,)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def build_index(engine: Engine, name: str, query: Select, key) -> None:
+    """(Re)build the FTS5 table ``name`` from the rows of ``query``.
+
+    The new table is filled under a temporary name and swapped in within a
+    single transaction, so concurrent readers always see a complete index.
+    Only one worker builds at a time; others skip while the lock is held.
+    """
+    lock_file = open(cache_dir() / "search.lock", "w")
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        version = _index_version(query)
+        if _indexed_version(name) == version:
+            return
+
+        columns = list(query.selected_columns)
+        source = query.with_only_columns(
+            key.label("key"),
+            *[cast(c, String).label(f"c{idx}") for idx, c in enumerate(columns)],
+        ).order_by(None)
+        staging = f"{name}_staging"
+        column_defs = ", ".join(f"c{idx}" for idx in range(len(columns)))
+        placeholders = ", ".join("?" * (len(columns) + 1))
+
+        conn = sqlite3.connect(index_path(), timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_meta "
+                "(name TEXT PRIMARY KEY, version TEXT NOT NULL)"
+            )
+            conn.execute(f"DROP TABLE IF EXISTS {staging}")
+            conn.execute(
+                f"CREATE VIRTUAL TABLE {staging} USING fts5("
+                f"key UNINDEXED, {column_defs}, tokenize='trigram')"
+            )
+            with engine.connect() as source_conn:
+                result = source_conn.execution_options(
+                    stream_results=True, yield_per=BATCH_SIZE
+                ).execute(source)
+                for rows in result.partitions(BATCH_SIZE):
+                    conn.executemany(
+                        f"INSERT INTO {staging} VALUES ({placeholders})",
+                        [tuple(r) for r in rows],
+                    )
+            conn.execute(f"INSERT INTO {staging}({staging}) VALUES ('optimize')")
+            conn.commit()
+            with conn:
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                conn.execute(f"ALTER TABLE {staging} RENAME TO {name}")
+                conn.execute(
+                    "INSERT OR REPLACE INTO index_meta VALUES (?, ?)", (name, version)
+                )
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Error building {name} search index: {e}")
+    finally:
+        lock_file.close()
+        with _building_lock:
+            _building.discard(name)
+
+
+def _schedule_build(engine: Engine, name: str, query: Select, key) -> None:
+    with _building_lock:
+        if name in _building:
+            return
+        _building.add(name)
+    threading.Thread(
+        target=build_index, args=(engine, name, query, key), daemon=True
+    ).start()
+
+
+def match_filter(database: SQLAlchemy, name: str, query: Select, key, term: str):
+    """Return a WHERE clause answering ``term`` from the search index.
+
+    Returns None when the index cannot answer the search (non-SQLite backend,
+    no sync marker, a term shorter than a trigram, or an index that is
+    missing or stale); callers should fall back to LIKE in that case. A stale
+    index is rebuilt in the background.
+    """
+    engine = database.engine
+    if engine.dialect.name != "sqlite" or get_db_sync_marker() is None:
+        return None
+    if len(term) < MIN_TERM_LENGTH:
+        return None
+    if _indexed_version(name) != _index_version(query):
+        _schedule_build(engine, name, query, key)
+        return None
+
+    phrase = '"' + term.replace('"', '""') + '"'
+    matches = (
+        text(f"SELECT key FROM {SCHEMA}.{name}(:search_phrase)")
+        .bindparams(search_phrase=phrase)
+        .columns(column("key"))
+    )
+    return key.in_(matches)
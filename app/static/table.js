@@ -9,10 +9,41 @@ function createDataTable(selector) {
 }
 
 function createServerDataTable(selector, ajaxUrl, columns) {
+  /* Send back the cursor of the page on screen so the server can seek to the
+     neighbouring page instead of using OFFSET */
+  let cursor = null;
+  const ajax = typeof ajaxUrl === 'string' ? { url: ajaxUrl } : { ...ajaxUrl };
+  const extraData = ajax.data;
+  ajax.data = function (d) {
+    // Rows come back as arrays, with the column names sent once
+    d.format = 'compact';
+    if (cursor) {
+      d.cursor = cursor;
+    }
+    if (typeof extraData === 'function') {
+      return extraData(d);
+    }
+    return extraData ? { ...d, ...extraData } : d;
+  };
+  const extraDataSrc = ajax.dataSrc;
+  ajax.dataSrc = function (json) {
+    cursor = json.cursor || null;
+    if (json.columns && json.data) {
+      const names = json.columns;
+      json.data = json.data.map(row => Array.isArray(row)
+        ? Object.fromEntries(names.map((name, idx) => [name, row[idx]]))
+        : row);
+    }
+    if (typeof extraDataSrc === 'function') {
+      return extraDataSrc(json);
+    }
+    return json[extraDataSrc || 'data'];
+  };
+
   return $(selector).DataTable({
     serverSide: true,
     processing: true,
-    ajax: ajaxUrl,
+    ajax: ajax,
     columns: columns,
     order: [],
     pageLength: 20,
@@ -0,0 +1,171 @@
+"""Precomputed, ready-to-plot aggregates for the isolate stats page."""
+
+import math
+import random
+from flask_sqlalchemy import SQLAlchemy
+from marc_db.models import Assembly, AssemblyQC, Isolate, TaxonomicAssignment
+from sqlalchemy import case, func, literal, select
+from app import get_db_sync_marker
+from app.cache import SharedCache, make_key
+
+HISTOGRAM_METRICS = ["contig_count", "avg_contig_coverage", "genome_size"]
+SCALES = ("linear", "log")
+# Species beyond the most common ones are grouped together as "Other"
+MAX_SPECIES = 4
+UNKNOWN_SPECIES = "Unknown"
+OTHER_SPECIES = "Other"
+
+_stats_cache = SharedCache("stats", max_entries=256)
+
+
+def assembly_metrics_query(tool="sylph", species=None, collection=None):
+    """Select per-assembly QC metrics with the species called by ``tool``."""
+    query = (
+        select(
+            Assembly.id.label("assembly_id"),
+            Assembly.isolate_id,
+            AssemblyQC.contig_count,
+            AssemblyQC.avg_contig_coverage,
+            AssemblyQC.genome_size,
+            AssemblyQC.completeness,
+            AssemblyQC.contamination,
+            TaxonomicAssignment.classification.label("suspected_organism"),
+        )
+        .join(AssemblyQC, Assembly.id == AssemblyQC.assembly_id)
+        .join(TaxonomicAssignment, Assembly.id == TaxonomicAssignment.assembly_id)
+        .where(TaxonomicAssignment.tool == tool)
+    )
+    if species:
+        query = query.where(TaxonomicAssignment.classification == species)
+    if collection:
+        query = query.join(Isolate, Assembly.isolate_id == Isolate.sample_id).where(
+            Isolate.special_collection == collection
+        )
+    return query
+
+
+def _bin_edges(low, high, bins, scale):
+    if low is None or high is None:
+        return None
+    if scale == "log":
+        low, high = math.log10(low), math.log10(high)
+    width = (high - low) / bins
+    edges = [low + i * width for i in range(bins + 1)]
+    if scale == "log":
+        edges = [10**e for e in edges]
+    return edges
+
+
+def _bin_case(col, edges):
+    """SQL expression for the index of the bin of ``edges`` that ``col`` falls in.
+
+    Bins include their lower edge; the last one also includes the upper edge.
+    """
+    if len(edges) == 2 or edges[0] == edges[-1]:
+        return literal(0)
+    return case(
+        *[(col < edge, idx) for idx, edge in enumerate(edges[1:-1])],
+        else_=len(edges) - 2,
+    )
+
+
+def compute_isolate_stats(
+    database: SQLAlchemy, bins=10, scale="linear", tool="sylph", points=2000
+):
+    """Histogram bins per species group and a sampled completeness/contamination scatter.
+
+    Bins are counted in the database, with edges shared by all species groups
+    of a metric so the bars can be stacked; on a log scale, values of zero or
+    less are left out. The scatter keeps a uniform random sample of at most
+    ``points`` assemblies, with a fixed seed so every worker returns the same
+    sample.
+    """
+    metrics = assembly_metrics_query(tool).subquery()
+    species = func.coalesce(metrics.c.suspected_organism, UNKNOWN_SPECIES)
+
+    species_counts = database.session.execute(
+        select(species, func.count())
+        .group_by(species)
+        .order_by(func.count().desc(), species)
+    ).all()
+    top_species = [name for name, _ in species_counts[:MAX_SPECIES]]
+    groups = list(top_species)
+    if len(species_counts) > MAX_SPECIES:
+        groups.append(OTHER_SPECIES)
+
+    group = case((species.in_(top_species), species), else_=OTHER_SPECIES)
+    edges = {}
+    counts = {}
+    for metric in HISTOGRAM_METRICS:
+        col = metrics.c[metric]
+        # Values that can't be placed on a log axis are left out
+        values = col > 0 if scale == "log" else col.isnot(None)
+        low, high = database.session.execute(
+            select(func.min(col), func.max(col)).where(values)
+        ).one()
+        edges[metric] = _bin_edges(low, high, bins, scale)
+        if edges[metric] is None:
+            continue
+        counts[metric] = {name: [0] * bins for name in groups}
+        # Group on the labels of a subquery rather than the expressions, whose
+        # bound parameters would not match between SELECT and GROUP BY
+        binned = (
+            select(group.label("name"), _bin_case(col, edges[metric]).label("idx"))
+            .where(values)
+            .subquery()
+        )
+        for name, idx, count in database.session.execute(
+            select(binned.c.name, binned.c.idx, func.count()).group_by(
+                binned.c.name, binned.c.idx
+            )
+        ):
+            counts[metric][name][idx] = count
+
+    sample = []
+    seen = 0
+    rng = random.Random(0)
+    rows = database.session.execute(
+        select(
+            metrics.c.contamination,
+            metrics.c.completeness,
+            metrics.c.assembly_id,
+            group,
+        )
+        .where(metrics.c.completeness.isnot(None))
+        .where(metrics.c.contamination.isnot(None))
+        .order_by(metrics.c.assembly_id),
+        execution_options={"stream_results": True},
+    )
+    for row in rows:
+        point = list(row)
+        seen += 1
+        if len(sample) < points:
+            sample.append(point)
+        else:
+            idx = rng.randrange(seen)
+            if idx < points:
+                sample[idx] = point
+
+    return {
+        "groups": groups,
+        "scale": scale,
+        "histograms": {
+            metric: {"edges": edges[metric], "counts": counts[metric]}
+            for metric in counts
+        },
+        "scatter": {
+            "columns": ["contamination", "completeness", "assembly_id", "group"],
+            "points": sorted(sample, key=lambda p: p[2]),
+            "total": seen,
+        },
+    }
+
+
+def isolate_stats(database: SQLAlchemy, **params):
+    """Return ``compute_isolate_stats(**params)``, cached until the next DB sync."""
+    marker = get_db_sync_marker()
+    if marker is None:
+        return compute_isolate_stats(database, **params)
+    return _stats_cache.get_or_set(
+        make_key(marker, params), lambda: compute_isolate_stats(database, **params)
+    )
@@ -0,0 +1,105 @@
+"""Summary snapshot of the collection shown on the index page.
+
+The aggregates behind the index page only change when a new DB sync lands,
+so they are computed once per sync marker and kept in the shared cache.
+When the marker changes, the previous snapshot keeps being served while a
+background thread computes the new one.
+"""
+
+import threading
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from marc_db.models import Isolate
+from sqlalchemy import desc, func, select
+from app import get_db_sync_marker
+from app.cache import SharedCache
+
+TOP_SPECIES = 10
+_LATEST = "latest"
+
+_summary_cache = SharedCache("summary", max_entries=4)
+_refreshing = threading.Lock()
+
+
+def empty_summary() -> dict:
+    return {
+        "isolate_count": 0,
+        "patient_count": 0,
+        "special_collections": [],
+        "species": [],
+    }
+
+
+def compute_summary(database: SQLAlchemy) -> dict:
+    """Run the index page aggregate queries."""
+    session = database.session
+    isolate_count = session.scalar(select(func.count(Isolate.sample_id)))
+    patient_count = session.scalar(
+        select(func.count(func.distinct(Isolate.subject_id)))
+    )
+    # Get counts of all special collections in a single query
+    special_collections = session.execute(
+        select(Isolate.special_collection, func.count(Isolate.sample_id))
+        .where(Isolate.special_collection.is_not(None))
+        .group_by(Isolate.special_collection)
+    ).all()
+    # Get counts of the most common species in the collection
+    species = session.execute(
+        select(Isolate.suspected_organism, func.count(Isolate.sample_id).label("count"))
+        .where(Isolate.suspected_organism.is_not(None))
+        .where(Isolate.suspected_organism != "Unknown")
+        .group_by(Isolate.suspected_organism)
+        .order_by(desc("count"))
+        .limit(TOP_SPECIES)
+    ).all()
+    return {
+        "isolate_count": isolate_count,
+        "patient_count": patient_count,
+        "special_collections": [list(r) for r in special_collections],
+        "species": [list(r) for r in species],
+    }
+
+
+def refresh_summary(app: Flask, database: SQLAlchemy, marker: str) -> None:
+    """Compute and store the snapshot for ``marker``."""
+    try:
+        with app.app_context():
+            summary = compute_summary(database)
+        _summary_cache.set(_LATEST, {"marker": marker, "summary": summary})
+    except Exception as e:
+        print(f"Error refreshing summary snapshot: {e}")
+
+
+def _refresh_in_background(app: Flask, database: SQLAlchemy, marker: str) -> None:
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_summary(app, database, marker)
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_summary(app: Flask, database: SQLAlchemy) -> dict:
+    """Return the summary snapshot for the current DB sync.
+
+    Without a sync marker there is nothing to key a snapshot on, so the
+    aggregates are computed directly.
+    """
+    marker = get_db_sync_marker()
+    if marker is None:
+        return compute_summary(database)
+
+    latest = _summary_cache.get(_LATEST)
+    if latest is not None and latest["marker"] == marker:
+        return latest["summary"]
+    if latest is not None:
+        _refresh_in_background(app, database, marker)
+        return latest["summary"]
+
+    summary = compute_summary(database)
+    _summary_cache.set(_LATEST, {"marker": marker, "summary": summary})
+    return summary
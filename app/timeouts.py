@@ -0,0 +1,106 @@
+"""Time budgets for ad-hoc SQL.
+
+User supplied SQL can run for arbitrarily long; without a deadline of its own
+a runaway query is only stopped by gunicorn killing the whole worker. A budget
+is enforced inside the database connection instead: a progress handler that
+interrupts the statement on SQLite, ``SET LOCAL statement_timeout`` on
+PostgreSQL. The interrupted statement raises an error that ``is_timeout``
+recognises, and the connection stays usable.
+
+Budgets are configured per endpoint in ``app.config["QUERY_TIMEOUTS"]`` (in
+seconds), which can be overridden with MARC_QUERY_TIMEOUTS, e.g.
+``MARC_QUERY_TIMEOUTS="api_query=10,download=600"``. An endpoint without a
+budget, or with a budget of 0, runs unbounded.
+"""
+
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Optional
+from flask import Flask, current_app, request
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+DEFAULT_TIMEOUTS = {
+    "query": 10,
+    "api_query": 30,
+    "api": 60,
+    "download": 300,
+    "api_assembly_metrics": 60,
+}
+# Number of SQLite VM instructions between deadline checks
+PROGRESS_INTERVAL = 10000
+# PostgreSQL SQLSTATE for a cancelled statement
+QUERY_CANCELED = "57014"
+
+
+class QueryTimeout(Exception):
+    """A statement was cancelled for exceeding its time budget."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        super().__init__(f"Query cancelled after exceeding its {seconds:g}s time limit")
+
+
+def init_app(app: Flask) -> None:
+    """Set the per-endpoint budgets from DEFAULT_TIMEOUTS and MARC_QUERY_TIMEOUTS."""
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    for item in os.environ.get("MARC_QUERY_TIMEOUTS", "").split(","):
+        if "=" in item:
+            endpoint, seconds = item.split("=", 1)
+            timeouts[endpoint.strip()] = float(seconds)
+    app.config.setdefault("QUERY_TIMEOUTS", timeouts)
+
+
+def request_timeout() -> Optional[float]:
+    """Return the budget for the current endpoint, or None for no limit."""
+    seconds = current_app.config.get("QUERY_TIMEOUTS", {}).get(request.endpoint)
+    return seconds or None
+
+
+def is_timeout(error: Exception) -> bool:
+    """Whether ``error`` is a statement interrupted by a time budget."""
+    orig = getattr(error, "orig", error)
+    if isinstance(orig, sqlite3.OperationalError):
+        return str(orig) == "interrupted"
+    return getattr(orig, "pgcode", None) == QUERY_CANCELED
+
+
+def start_budget(connection: Connection, seconds: Optional[float]) -> None:
+    """Cancel statements on ``connection`` running past ``seconds`` from now.
+
+    On PostgreSQL the limit applies to each statement of the current
+    transaction; on SQLite it covers everything run until ``clear_budget``.
+    """
+    if not seconds:
+        return
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        deadline = time.monotonic() + seconds
+        connection.connection.driver_connection.set_progress_handler(
+            lambda: time.monotonic() > deadline, PROGRESS_INTERVAL
+        )
+    elif dialect == "postgresql":
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+
+
+def clear_budget(connection: Connection) -> None:
+    """Remove a budget set by ``start_budget`` before the connection is reused."""
+    if connection.dialect.name == "sqlite" and not connection.closed:
+        connection.connection.driver_connection.set_progress_handler(None, 0)
+
+
+@contextmanager
+def statement_budget(connection: Connection, seconds: Optional[float]):
+    """Run the block under a time budget, raising QueryTimeout when it runs out."""
+    start_budget(connection, seconds)
+    try:
+        yield
+    except DBAPIError as e:
+        if is_timeout(e):
+            raise QueryTimeout(seconds) from e
+        raise
+    finally:
+        clear_budget(connection)
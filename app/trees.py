@@ -0,0 +1,242 @@
+"""Parsed, cached phylogenetic trees for the species pages.
+
+Treefiles are Newick strings that can run to several MB for common species.
+They are parsed once per file version (path and modification time) into a
+tree of ``Node`` objects, kept in a small LRU cache, and trimmed on request
+to the part the browser will draw before being written back out as Newick.
+
+Parsing and writing are iterative, so deeply nested (e.g. ladder-like) trees
+do not run into Python's recursion limit.
+"""
+
+import functools
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+# Number of parsed trees kept per worker
+TREE_CACHE_SIZE = int(os.environ.get("MARC_TREE_CACHE_SIZE", 8))
+
+_LABEL_END = set("(),:;[")
+_NEEDS_QUOTES = set("()[]':;, \t\n")
+
+
+class Node:
+    __slots__ = ("name", "length", "children")
+
+    def __init__(self, name: str = "", length: Optional[float] = None, children=None):
+        self.name = name
+        self.length = length
+        self.children = children if children is not None else []
+
+
+def parse_newick(text: str) -> Node:
+    """Parse a Newick string, raising ValueError if it is malformed."""
+    root = Node()
+    node = root
+    stack = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == "(":
+            child = Node()
+            node.children.append(child)
+            stack.append(node)
+            node = child
+            i += 1
+        elif c == ",":
+            if not stack:
+                raise ValueError(f"Unexpected ',' at position {i}")
+            node = Node()
+            stack[-1].children.append(node)
+            i += 1
+        elif c == ")":
+            if not stack:
+                raise ValueError(f"Unbalanced ')' at position {i}")
+            node = stack.pop()
+            i += 1
+        elif c == ":":
+            j = i + 1
+            while j < n and text[j] not in _LABEL_END:
+                j += 1
+            try:
+                node.length = float(text[i + 1 : j])
+            except ValueError:
+                raise ValueError(f"Invalid branch length at position {i}") from None
+            i = j
+        elif c == "[":
+            j = text.find("]", i)
+            if j == -1:
+                raise ValueError(f"Unterminated comment at position {i}")
+            i = j + 1
+        elif c == "'":
+            chars = []
+            i += 1
+            while True:
+                j = text.find("'", i)
+                if j == -1:
+                    raise ValueError("Unterminated quoted label")
+                chars.append(text[i:j])
+                # A doubled quote is an escaped quote
+                if text.startswith("''", j):
+                    chars.append("'")
+                    i = j + 2
+                else:
+                    i = j + 1
+                    break
+            node.name = "".join(chars)
+        elif c == ";":
+            break
+        elif c.isspace():
+            i += 1
+        else:
+            j = i
+            while j < n and text[j] not in _LABEL_END and not text[j].isspace():
+                j += 1
+            node.name = text[i:j]
+            i = j
+    if stack:
+        raise ValueError("Unbalanced '(' in tree")
+    return root
+
+
+def _label(node: Node) -> str:
+    name = node.name
+    if name and _NEEDS_QUOTES.intersection(name):
+        name = "'" + name.replace("'", "''") + "'"
+    if node.length is not None:
+        name += f":{node.length!r}"
+    return name
+
+
+def to_newick(root: Node) -> str:
+    """Write a tree back out as a Newick string."""
+    out = []
+    stack = [(root, 0)]
+    while stack:
+        node, idx = stack.pop()
+        if idx == 0 and node.children:
+            out.append("(")
+        if idx < len(node.children):
+            if idx > 0:
+                out.append(",")
+            stack.append((node, idx + 1))
+            stack.append((node.children[idx], 0))
+            continue
+        if node.children:
+            out.append(")")
+        out.append(_label(node))
+    return "".join(out) + ";"
+
+
+def _postorder(root: Node) -> Iterator[Node]:
+    """Yield every node after all of its descendants."""
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(node.children)
+    return reversed(order)
+
+
+def leaf_names(root: Node) -> list[str]:
+    return [node.name for node in _postorder(root) if not node.children]
+
+
+def subtree(root: Node, names: Iterable[str]) -> Optional[Node]:
+    """Return the smallest clade containing every leaf in ``names``.
+
+    Names that are not leaves of the tree are ignored; returns None if none
+    of them are.
+    """
+    names = set(names)
+    parents = {}
+    leaves = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for child in node.children:
+            parents[id(child)] = node
+            stack.append(child)
+        if not node.children and node.name in names:
+            leaves.append(node)
+    if not leaves:
+        return None
+
+    def ancestors(node):
+        path = [node]
+        while id(node) in parents:
+            node = parents[id(node)]
+            path.append(node)
+        return path[::-1]
+
+    common = ancestors(leaves[0])
+    for leaf in leaves[1:]:
+        path = ancestors(leaf)
+        depth = 0
+        while depth < min(len(common), len(path)) and common[depth] is path[depth]:
+            depth += 1
+        common = common[:depth]
+    return common[-1]
+
+
+def prune(root: Node, names: Iterable[str]) -> Optional[Node]:
+    """Return a copy of the tree with only the leaves in ``names``.
+
+    Internal nodes left with a single child are merged into it, adding up
+    their branch lengths. Returns None if no leaf is kept.
+    """
+    names = set(names)
+    pruned = {}
+    for node in _postorder(root):
+        if not node.children:
+            if node.name in names:
+                pruned[id(node)] = Node(node.name, node.length)
+            continue
+        children = [pruned[id(c)] for c in node.children if id(c) in pruned]
+        if len(children) > 1:
+            pruned[id(node)] = Node(node.name, node.length, children)
+        elif children:
+            child = children[0]
+            if node.length is not None:
+                child.length = (child.length or 0) + node.length
+            pruned[id(node)] = child
+    return pruned.get(id(root))
+
+
+def collapse(root: Node, depth: int) -> Node:
+    """Return a copy of the tree with clades below ``depth`` shown as one leaf.
+
+    A collapsed clade is labelled with its name, if any, and its leaf count.
+    """
+    leaf_counts = {}
+    for node in _postorder(root):
+        leaf_counts[id(node)] = (
+            sum(leaf_counts[id(c)] for c in node.children) if node.children else 1
+        )
+
+    copy = Node(root.name, root.length)
+    stack = [(root, copy, 0)]
+    while stack:
+        node, new, level = stack.pop()
+        for child in node.children:
+            if child.children and level + 1 >= depth:
+                label = f"{leaf_counts[id(child)]} leaves"
+                name = f"{child.name} ({label})" if child.name else label
+                new.children.append(Node(name, child.length))
+            else:
+                new_child = Node(child.name, child.length)
+                new.children.append(new_child)
+                stack.append((child, new_child, level + 1))
+    return copy
+
+
+@functools.lru_cache(maxsize=TREE_CACHE_SIZE)
+def _load(path: str, mtime_ns: int) -> Node:
+    return parse_newick(Path(path).read_text())
+
+
+def load_tree(path: Path) -> Node:
+    """Return the parsed tree in ``path``, reusing it until the file changes."""
+    return _load(str(path), path.stat().st_mtime_ns)
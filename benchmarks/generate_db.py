@@ -0,0 +1,189 @@
+"""Generate a synthetic mARC database for benchmarking.
+
+Tables are created from the ``marc_db.models`` schema and filled with
+plausible values: foreign keys point at existing parent rows, species and
+special collections follow a skewed distribution, QC metrics fall in
+realistic ranges, and every other column gets a value of its type. Row counts
+scale with ``--isolates``:
+
+    python benchmarks/generate_db.py bench.sqlite --isolates 100000
+"""
+
+import argparse
+import datetime
+import random
+import sqlite3
+import time
+from pathlib import Path
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, create_engine
+from marc_db.models import Base
+
+BATCH_SIZE = 10000
+
+# Rows per isolate for each table; tables not listed get one row per isolate
+ROWS_PER_ISOLATE = {
+    "isolates": 1,
+    "aliquots": 2,
+    "assemblies": 1,
+    "assembly_qc": 1,
+    "taxonomic_assignments": 2,
+    "contaminants": 1,
+}
+
+SPECIES = [
+    ("Escherichia coli", 30),
+    ("Staphylococcus aureus", 20),
+    ("Klebsiella pneumoniae", 12),
+    ("Enterococcus faecalis", 8),
+    ("Pseudomonas aeruginosa", 8),
+    ("Staphylococcus epidermidis", 6),
+    ("Clostridioides difficile", 4),
+    ("Enterobacter cloacae", 4),
+    ("Unknown", 3),
+    ("Acinetobacter baumannii", 2),
+    ("Serratia marcescens", 2),
+    ("Proteus mirabilis", 1),
+]
+SPECIAL_COLLECTIONS = [
+    (None, 60),
+    ("Bacteremia", 15),
+    ("Surveillance", 12),
+    ("CoNS", 6),
+    ("AST", 5),
+    ("C. diff", 2),
+]
+GENE_SYMBOLS = ["blaTEM-1", "blaCTX-M-15", "mecA", "vanA", "tet(M)", "aac(6')-Ib"]
+ELEMENT_TYPES = ["AMR", "VIRULENCE", "STRESS"]
+TOOLS = ["sylph", "gtdbtk"]
+
+
+def _weighted(rnd, choices):
+    values, weights = zip(*choices)
+    return rnd.choices(values, weights)[0]
+
+
+def _column_value(rnd, table, column, idx, rows):
+    """Value of ``column`` for row ``idx`` of ``rows`` in ``table``."""
+    name = column.name
+    if name in ("suspected_organism", "classification"):
+        return _weighted(rnd, SPECIES)
+    if name == "special_collection":
+        return _weighted(rnd, SPECIAL_COLLECTIONS)
+    if name == "tool":
+        # Each parent gets one row per tool when there are two rows per parent
+        return TOOLS[idx * len(TOOLS) // rows]
+    if name == "gene_symbol":
+        return rnd.choice(GENE_SYMBOLS)
+    if name == "element_type":
+        return rnd.choice(ELEMENT_TYPES)
+    if name == "completeness":
+        return round(min(100.0, rnd.gauss(97, 3)), 2)
+    if name == "contamination":
+        return round(rnd.expovariate(1.5), 2)
+    if name == "contig_count":
+        return rnd.randint(20, 600)
+    if name == "genome_size":
+        return rnd.randint(1_800_000, 7_000_000)
+    if name == "n50":
+        return rnd.randint(5_000, 600_000)
+    if name == "gc_content":
+        return round(rnd.uniform(0.3, 0.7), 3)
+    if name.endswith("_coverage"):
+        return round(rnd.lognormvariate(4, 0.7), 1)
+
+    column_type = column.type
+    if column.nullable and not column.primary_key and rnd.random() < 0.05:
+        return None
+    if isinstance(column_type, Boolean):
+        return rnd.random() < 0.5
+    if isinstance(column_type, Integer):
+        return rnd.randint(0, 100_000)
+    if isinstance(column_type, Float):
+        return round(rnd.uniform(0, 100), 3)
+    if isinstance(column_type, (Date, DateTime)):
+        day = datetime.date(2015, 1, 1) + datetime.timedelta(days=rnd.randint(0, 3650))
+        return day.isoformat()
+    return f"{name}_{idx:07d}"
+
+
+def _table_rows(rnd, table, rows, keys):
+    """Yield the rows of ``table``, recording its primary keys in ``keys``."""
+    primary_key = list(table.primary_key.columns)
+    key_column = primary_key[0] if len(primary_key) == 1 else None
+    table_keys = []
+    for idx in range(rows):
+        row = []
+        for column in table.columns:
+            foreign_keys = list(column.foreign_keys)
+            parent_keys = (
+                keys.get(foreign_keys[0].column.table.name) if foreign_keys else None
+            )
+            if parent_keys:
+                # Spread children evenly so every parent has some
+                value = parent_keys[idx % len(parent_keys)]
+            elif column is key_column and isinstance(column.type, Integer):
+                value = idx + 1
+            elif column is key_column:
+                value = f"{table.name[:3].upper()}{idx:07d}"
+            else:
+                value = _column_value(rnd, table, column, idx, rows)
+            row.append(value)
+            if column is key_column:
+                table_keys.append(value)
+        yield row
+    keys[table.name] = table_keys
+
+
+def generate(path: Path, isolates: int, amr_per_assembly: float, seed: int = 0):
+    """Create ``path`` and fill it with a synthetic database."""
+    if path.exists():
+        path.unlink()
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    rnd = random.Random(seed)
+    per_isolate = {**ROWS_PER_ISOLATE, "antimicrobials": amr_per_assembly}
+    keys = {}
+    conn = sqlite3.connect(path)
+    try:
+        for table in Base.metadata.sorted_tables:
+            start = time.perf_counter()
+            rows = int(isolates * per_isolate.get(table.name, 1))
+            for column in table.primary_key.columns:
+                # A table keyed by its parent has at most one row per parent
+                for fk in column.foreign_keys:
+                    rows = min(rows, len(keys.get(fk.column.table.name, [])))
+            placeholders = ", ".join("?" * len(table.columns))
+            insert = f"INSERT INTO {table.name} VALUES ({placeholders})"
+            batch = []
+            for row in _table_rows(rnd, table, rows, keys):
+                batch.append(row)
+                if len(batch) == BATCH_SIZE:
+                    conn.executemany(insert, batch)
+                    batch = []
+            conn.executemany(insert, batch)
+            conn.commit()
+            elapsed = time.perf_counter() - start
+            print(f"{table.name}: {rows} rows in {elapsed:.1f}s")
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path, help="SQLite file to create")
+    parser.add_argument(
+        "--isolates", type=int, default=10000, help="Number of isolates"
+    )
+    parser.add_argument(
+        "--amr-per-assembly",
+        type=float,
+        default=4,
+        help="Average number of antimicrobial hits per assembly",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate(args.path, args.isolates, args.amr_per_assembly, args.seed)
@@ -0,0 +1,227 @@
+"""Latency and memory benchmarks of the browse APIs.
+
+Each scenario replays the requests a DataTable makes (first page, paging
+forward with the cursor, jumping deep into the table, sorting, global and
+column search) through the Flask test client against a database made by
+``generate_db.py``. For every scenario the p50 and p95 latencies over
+``--iterations`` runs and the peak memory allocated by one run are reported
+and, with ``--baseline``, compared to a stored run:
+
+    python benchmarks/generate_db.py /tmp/bench.sqlite --isolates 100000
+    python -m benchmarks.run /tmp/bench.sqlite --output baseline.json
+    python -m benchmarks.run /tmp/bench.sqlite --baseline baseline.json
+
+The exit status is 1 if any scenario's p95 is more than ``--tolerance``
+slower than the baseline. Caches are kept in a fresh temporary directory, so
+the first iteration of a scenario is a cold run.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BROWSE_APIS = {
+    "isolates": 1,
+    "aliquots": 1,
+    "assemblies": 1,
+    "assembly_qc": 2,
+    "taxonomic_assignments": 2,
+    "antimicrobials": 3,
+}
+PAGE_LENGTH = 25
+QUERY = (
+    "SELECT a.isolate_id, q.genome_size, q.n50 FROM assemblies a "
+    "JOIN assembly_qc q ON q.assembly_id = a.id WHERE q.completeness > 95"
+)
+
+
+def _table_params(draw=1, start=0, search=None, order=None, column_search=None):
+    params = {"draw": draw, "start": start, "length": PAGE_LENGTH}
+    if search:
+        params["search[value]"] = search
+    if order is not None:
+        params["order[0][column]"], params["order[0][dir]"] = order
+    if column_search is not None:
+        idx, value = column_search
+        params[f"columns[{idx}][search][value]"] = value
+    return params
+
+
+def _get(client, url, params=None):
+    response = client.get(url, query_string=params)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return response
+
+
+def _paging(url):
+    """First page, then the next four pages using the returned cursor."""
+
+    def run(client):
+        params = _table_params()
+        for page in range(5):
+            payload = _get(client, url, params).get_json()
+            params = _table_params(draw=page + 2, start=(page + 1) * PAGE_LENGTH)
+            if "cursor" in payload:
+                params["cursor"] = payload["cursor"]
+
+    return run
+
+
+def _single(url, **table_params):
+    def run(client):
+        _get(client, url, _table_params(**table_params))
+
+    return run
+
+
+def _post(url, data):
+    def run(client):
+        response = client.post(url, data=data)
+        if response.status_code != 200:
+            raise RuntimeError(f"POST {url} returned {response.status_code}")
+        # Consume streamed bodies so their cost is measured
+        response.get_data()
+
+    return run
+
+
+def scenarios(total_rows):
+    """Return the benchmark scenarios as a dict of name to callable."""
+    result = {}
+    for name, search_column in BROWSE_APIS.items():
+        url = f"/api/{name}"
+        deep = max(0, total_rows.get(name, 0) // 2 // PAGE_LENGTH * PAGE_LENGTH)
+        result[f"{name}/first_page"] = _single(url)
+        result[f"{name}/paging"] = _paging(url)
+        result[f"{name}/deep_offset"] = _single(url, start=deep)
+        result[f"{name}/sort_desc"] = _single(url, order=(search_column, "desc"))
+        result[f"{name}/global_search"] = _single(url, search="coli")
+        result[f"{name}/column_search"] = _single(url, column_search=(0, "00001"))
+    result["assemblies/metrics"] = lambda client: _get(
+        client, "/api/assemblies/metrics"
+    )
+    result["query/first_page"] = _post(
+        "/api/query", {"query": QUERY, "draw": 1, "start": 0, "length": PAGE_LENGTH}
+    )
+    result["download/csv"] = _post("/download", {"query": QUERY, "format": "csv"})
+    return result
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[idx]
+
+
+def measure(client, run, iterations):
+    """Return p50/p95 latency in ms and peak traced memory in KiB of ``run``."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        run(client)
+        samples.append((time.perf_counter() - start) * 1000)
+    # Tracing slows Python down, so memory is measured in a separate run
+    tracemalloc.start()
+    try:
+        run(client)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(_percentile(samples, 95), 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each scenario against ``baseline``, returning the regressed ones."""
+    regressions = []
+    print(
+        f"{'scenario':40} {'p50 ms':>9} {'p95 ms':>9} {'peak KiB':>10} {'vs base':>8}"
+    )
+    for name, stats in results.items():
+        change = ""
+        base = baseline.get(name)
+        if base and base["p95_ms"] > 0:
+            ratio = stats["p95_ms"] / base["p95_ms"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > tolerance:
+                regressions.append(name)
+                change += " !"
+        print(
+            f"{name:40} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+            f"{stats['peak_kib']:10.1f} {change:>8}"
+        )
+    return regressions
+
+
+def _row_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {
+            name: conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            for name in BROWSE_APIS
+        }
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db", type=Path, help="SQLite database from generate_db.py")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--scenario", action="append", help="Only run scenarios starting with this"
+    )
+    parser.add_argument("--output", type=Path, help="Write results as JSON here")
+    parser.add_argument(
+        "--baseline", type=Path, help="Compare to results saved with --output"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed p95 slowdown relative to the baseline (default 0.25)",
+    )
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time
+    os.environ["MARC_DB_URL"] = f"sqlite:///{args.db.resolve()}"
+    os.environ.setdefault("MARC_CACHE_DIR", tempfile.mkdtemp(prefix="marc_bench_"))
+    # Keep slow query logs from burying the report
+    os.environ.setdefault("MARC_SLOW_QUERY_MS", "60000")
+    from app.app import app
+
+    app.config["TESTING"] = True
+    client = app.test_client()
+
+    selected = {
+        name: run
+        for name, run in scenarios(_row_counts(args.db)).items()
+        if not args.scenario or name.startswith(tuple(args.scenario))
+    }
+    results = {
+        name: measure(client, run, args.iterations) for name, run in selected.items()
+    }
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    regressions = compare(results, baseline, args.tolerance)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+    if regressions:
+        print(f"Slower than baseline: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""gunicorn settings, loaded automatically from the working directory.
+
+Worker processes come and go (``--max-requests``), so their Prometheus
+metric files have to be cleaned up for ``/metrics`` to stay correct across
+workers; see ``app.metrics``.
+"""
+
+import os
+import shutil
+
+
+def on_starting(server):
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Metric files left by a previous run would be counted again
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
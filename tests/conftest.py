@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+
+@pytest.fixture
+def metadata():
+    """Tables to create in ``database``; test modules override this."""
+    return None
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path, metadata):
+    """A file-backed SQLite database with an engine and a session.
+
+    MARC_DB_URL and MARC_CACHE_DIR point into ``tmp_path``. Test modules seed
+    their own tables by overriding this fixture.
+    """
+    db_fp = tmp_path / "db.sqlite"
+    monkeypatch.setenv("MARC_DB_URL", f"sqlite:///{db_fp}")
+    monkeypatch.setenv("MARC_CACHE_DIR", str(tmp_path / "cache"))
+    engine = create_engine(
+        f"sqlite:///{db_fp}", connect_args={"check_same_thread": False}
+    )
+    if metadata is not None:
+        metadata.create_all(engine)
+    database = SimpleNamespace(engine=engine, session=Session(engine))
+    yield database
+    database.session.close()
+    engine.dispose()
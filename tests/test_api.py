@@ -1,23 +1,39 @@
+import gzip
+import os
+import subprocess
+import sys
+import time
+
 import pytest
 
 
-@pytest.fixture
-def client(monkeypatch):
-    monkeypatch.setenv("MARC_DB_URL", "sqlite:///:memory:")
+class DummyChatOpenAI:
+    prompts = []
 
-    class DummyChatOpenAI:
-        def __init__(self, *args, **kwargs):
-            pass
+    def __init__(self, *args, **kwargs):
+        pass
 
-        def with_structured_output(self, _schema):
-            return self
+    def with_structured_output(self, _schema):
+        return self
 
-        def invoke(self, _prompt):
-            return {"query": "SELECT COUNT(*) AS count FROM isolates"}
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return {"query": "SELECT COUNT(*) AS count FROM isolates"}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setenv("MARC_DB_URL", "sqlite:///:memory:")
+    monkeypatch.setenv("MARC_CACHE_DIR", str(tmp_path / "cache"))
 
+    DummyChatOpenAI.prompts = []
     monkeypatch.setattr("langchain_openai.ChatOpenAI", DummyChatOpenAI)
 
-    from app.app import app
+    from app.app import app, db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
 
     with app.test_client() as client:
         yield client
@@ -28,6 +44,15 @@ def test_index(client):
     assert response.status_code == 200
 
 
+def test_index_summary_fallback(client, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr("app.app.get_summary", fail)
+    response = client.get("/")
+    assert response.status_code == 200
+
+
 def test_isolates_page(client):
     response = client.get("/isolates")
     assert response.status_code == 200
@@ -84,3 +109,728 @@ def test_nl_query_api(client):
     assert resp.status_code == 200
     data = resp.data.decode("utf-8")
     assert data == "SELECT COUNT(*) AS count FROM isolates"
+
+
+def test_nl_query_job(client):
+    resp = client.post("/api/nl_query/jobs", data={"prompt": "How many isolates?"})
+    assert resp.status_code == 202
+    job = resp.get_json()
+    assert resp.headers["Location"] == job["url"]
+
+    deadline = time.time() + 5
+    while job["status"] == "pending" and time.time() < deadline:
+        time.sleep(0.05)
+        job = client.get(resp.headers["Location"]).get_json()
+    assert job == {"status": "done", "query": "SELECT COUNT(*) AS count FROM isolates"}
+
+    # Answered from the SQL cache without waiting for the pool
+    resp = client.post("/api/nl_query/jobs", data={"prompt": "How many isolates?"})
+    assert resp.get_json()["status"] == "done"
+    assert len(DummyChatOpenAI.prompts) == 1
+
+    assert client.get("/api/nl_query/jobs/missing").status_code == 404
+    assert client.post("/api/nl_query/jobs", data={}).status_code == 400
+
+
+def test_nl_query_stack_loads_lazily(tmp_path):
+    env = {
+        **os.environ,
+        "MARC_DB_URL": "sqlite:///:memory:",
+        "MARC_CACHE_DIR": str(tmp_path),
+    }
+    code = "import sys, app.app; print('langgraph' in sys.modules)"
+    out = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    )
+    assert out.stdout.strip().splitlines()[-1] == "False"
+
+
+def test_nl_query_api_cached(client):
+    for prompt in ["How many isolates are there?", "  How many   isolates are there "]:
+        resp = client.post("/api/nl_query", data={"prompt": prompt})
+        assert resp.status_code == 200
+        assert resp.data == b"SELECT COUNT(*) AS count FROM isolates"
+    assert len(DummyChatOpenAI.prompts) == 1
+
+    resp = client.post(
+        "/api/nl_query",
+        data={"prompt": "How many isolates are there?", "query": "SELECT 1"},
+    )
+    assert resp.status_code == 200
+    assert len(DummyChatOpenAI.prompts) == 2
+
+    # Whitespace only matters inside the literals of the starting query
+    for query in ["SELECT  'a b'", "SELECT 'a b';", "SELECT 'a  b'"]:
+        resp = client.post(
+            "/api/nl_query",
+            data={"prompt": "How many isolates are there?", "query": query},
+        )
+        assert resp.status_code == 200
+    assert len(DummyChatOpenAI.prompts) == 4
+
+
+def test_keyset_cursor(client):
+    api_resp = client.get("/api/antimicrobials?draw=1&start=0&length=5")
+    assert api_resp.status_code == 200
+    cursor = api_resp.get_json()["cursor"]
+
+    for token in (cursor, "not-a-cursor"):
+        api_resp = client.get(
+            f"/api/antimicrobials?draw=2&start=5&length=5&cursor={token}"
+        )
+        assert api_resp.status_code == 200
+        assert "data" in api_resp.get_json()
+
+
+def _seed_browse_rows(db):
+    import datetime
+
+    from marc_db.models import Assembly, Isolate
+
+    for idx in range(1, 12):
+        db.session.add(
+            Isolate(
+                sample_id=f"S{idx:02d}",
+                subject_id=idx % 3 or None,
+                special_collection=["AST", None, "CF"][idx % 3],
+                received_date=(
+                    datetime.date(2024, 1, idx % 4 + 1) if idx % 5 else None
+                ),
+            )
+        )
+        db.session.add(
+            Assembly(
+                id=idx,
+                isolate_id=f"S{idx:02d}" if idx % 4 else None,
+                nanopore_path="reads.fastq" if idx % 2 else None,
+                run_number=str(idx % 3) if idx % 5 else None,
+            )
+        )
+    db.session.commit()
+
+
+@pytest.mark.parametrize(
+    "endpoint, columns", [("/api/assemblies", 9), ("/api/isolates", 7)]
+)
+def test_keyset_pages_match_offset_pages(client, endpoint, columns):
+    from app.app import db
+
+    with client.application.app_context():
+        _seed_browse_rows(db)
+
+    length = 3
+    for column in range(columns):
+        for direction in ("asc", "desc"):
+            url = (
+                f"{endpoint}?length={length}"
+                f"&order[0][column]={column}&order[0][dir]={direction}"
+            )
+            offset_pages = [
+                client.get(f"{url}&start={start}").get_json()["data"]
+                for start in range(0, 12, length)
+            ]
+            assert sum(len(p) for p in offset_pages) == 11
+
+            resp = client.get(f"{url}&start=0").get_json()
+            pages = [resp["data"]]
+            for start in range(length, 12, length):
+                resp = client.get(f"{url}&start={start}&cursor={resp['cursor']}")
+                assert resp.status_code == 200, (column, direction)
+                resp = resp.get_json()
+                pages.append(resp["data"])
+            assert pages == offset_pages, (column, direction)
+
+            for start in range(6, -1, -length):
+                resp = client.get(f"{url}&start={start}&cursor={resp['cursor']}")
+                resp = resp.get_json()
+                assert resp["data"] == offset_pages[start // length], (
+                    column,
+                    direction,
+                )
+
+
+def test_tampered_cursor_falls_back_to_offset(client):
+    import base64
+    import json
+
+    from app.app import db
+
+    with client.application.app_context():
+        _seed_browse_rows(db)
+
+    # Sorted by received_date, so the cursor holds dates to decode
+    columns = client.get("/api/isolates?length=1").get_json()["columns"]
+    column = columns.index("received_date")
+    url = f"/api/isolates?length=3&order[0][column]={column}&order[0][dir]=asc"
+    token = client.get(f"{url}&start=0").get_json()["cursor"]
+    cursor = json.loads(base64.urlsafe_b64decode(token))
+    expected = client.get(f"{url}&start=3").get_json()["data"]
+
+    tampered = [
+        {"start": "0"},
+        {"count": "3"},
+        {"count": True},
+        {"start": -3, "count": 6},
+        {"last": ["not-a-date", "S03"]},
+        {"last": [{"x": 1}, "S03"]},
+        {"last": [None, 3]},
+        {"last": [None]},
+        {"last": "S03"},
+    ]
+    for change in tampered:
+        raw = json.dumps({**cursor, **change}).encode("utf-8")
+        token = base64.urlsafe_b64encode(raw).decode("ascii")
+        resp = client.get(f"{url}&start=3&cursor={token}")
+        assert resp.status_code == 200, change
+        assert resp.get_json()["data"] == expected, change
+
+
+def test_download(client):
+    resp = client.post("/download", data={"query": "SELECT 1 AS one, 'a' AS two"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/csv"
+    assert resp.data.decode("utf-8").splitlines() == ["one,two", "1,a"]
+
+    resp = client.post(
+        "/download",
+        data={"query": "SELECT 1 AS one WHERE 0", "compression": "gzip"},
+    )
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/gzip"
+    assert gzip.decompress(resp.data).decode("utf-8").splitlines() == ["one"]
+
+
+@pytest.mark.parametrize("export_format", ["arrow", "parquet"])
+def test_download_arrow_formats(client, export_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    resp = client.post(
+        "/download",
+        data={
+            "query": "SELECT 1 AS one, 'a' AS two, NULL AS three",
+            "format": export_format,
+        },
+    )
+    assert resp.status_code == 200
+    if export_format == "parquet":
+        table = pq.read_table(pa.BufferReader(resp.data))
+    else:
+        table = pa.ipc.open_stream(resp.data).read_all()
+    assert table.to_pylist() == [{"one": 1, "two": "a", "three": None}]
+    assert pa.types.is_integer(table.schema.field("one").type)
+
+
+@pytest.mark.parametrize("export_format", ["arrow", "parquet"])
+def test_download_arrow_mixed_types(client, export_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    resp = client.post(
+        "/download",
+        data={
+            "query": "SELECT 1 AS x, 2 AS y UNION ALL SELECT 'a', 3",
+            "format": export_format,
+        },
+    )
+    assert resp.status_code == 200
+    if export_format == "parquet":
+        table = pq.read_table(pa.BufferReader(resp.data))
+    else:
+        table = pa.ipc.open_stream(resp.data).read_all()
+    assert table.to_pylist() == [{"x": "1", "y": 2}, {"x": "a", "y": 3}]
+
+
+def test_download_unknown_format(client):
+    resp = client.post("/download", data={"query": "SELECT 1", "format": "xlsx"})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("params", ["bins=0", "bins=500", "scale=cubic", "points=-1"])
+def test_isolate_stats_rejects_bad_params(client, params):
+    resp = client.get(f"/api/isolate_stats?{params}")
+    assert resp.status_code == 400
+
+
+def _seed_assembly_metrics(db):
+    from marc_db.models import Assembly, AssemblyQC, Isolate, TaxonomicAssignment
+
+    species = ["Escherichia coli", "Escherichia coli", "Klebsiella pneumoniae", None]
+    for idx, name in enumerate(species, 1):
+        db.session.add(
+            Isolate(sample_id=f"S{idx}", special_collection="AST" if idx % 2 else None)
+        )
+        db.session.add(Assembly(id=idx, isolate_id=f"S{idx}"))
+        db.session.add(
+            AssemblyQC(
+                assembly_id=idx,
+                contig_count=10 * idx,
+                avg_contig_coverage=float(idx),
+                genome_size=10**idx,
+                completeness=100.0 - idx,
+                contamination=float(idx),
+            )
+        )
+        db.session.add(
+            TaxonomicAssignment(assembly_id=idx, tool="sylph", classification=name)
+        )
+    db.session.add(
+        TaxonomicAssignment(assembly_id=1, tool="other", classification="Shigella")
+    )
+    db.session.commit()
+
+
+def test_assembly_metrics(client, monkeypatch):
+    from app.app import db
+
+    with client.application.app_context():
+        _seed_assembly_metrics(db)
+
+    # Several batches, so the rows of the stream are joined across chunks
+    monkeypatch.setattr("app.export.BATCH_SIZE", 2)
+    resp = client.get("/api/assemblies/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/json"
+    data = resp.get_json()["data"]
+    assert [r["assembly_id"] for r in data] == [1, 2, 3, 4]
+    assert data[0] == {
+        "assembly_id": 1,
+        "isolate_id": "S1",
+        "contig_count": 10,
+        "avg_contig_coverage": 1.0,
+        "genome_size": 10,
+        "completeness": 99.0,
+        "contamination": 1.0,
+        "suspected_organism": "Escherichia coli",
+    }
+
+    def assembly_ids(params):
+        resp = client.get(f"/api/assemblies/metrics?{params}")
+        return [r["assembly_id"] for r in resp.get_json()["data"]]
+
+    assert assembly_ids("species=Escherichia+coli") == [1, 2]
+    assert assembly_ids("collection=AST") == [1, 3]
+    assert assembly_ids("species=Escherichia+coli&collection=AST") == [1]
+    assert assembly_ids("tool=other") == [1]
+    assert assembly_ids("species=Salmonella+enterica") == []
+
+    # A failure mid-stream leaves a body that can't parse as complete
+    import json
+
+    from app.export import json_chunks
+
+    def failing_chunks(result):
+        chunks = json_chunks(result)
+        yield next(chunks)
+        yield next(chunks)
+        raise RuntimeError("disk I/O error")
+
+    monkeypatch.setattr("app.export.json_chunks", failing_chunks)
+    resp = client.get("/api/assemblies/metrics")
+    assert resp.status_code == 200
+    body = resp.data.decode("utf-8")
+    assert body.rstrip().endswith("# ERROR: export cut short: disk I/O error")
+    with pytest.raises(ValueError):
+        json.loads(body)
+
+
+def test_isolate_stats(client):
+    from app.app import db
+    from marc_db.models import Assembly, AssemblyQC, TaxonomicAssignment
+
+    with client.application.app_context():
+        _seed_assembly_metrics(db)
+        db.session.add(Assembly(id=5))
+        db.session.add(
+            AssemblyQC(assembly_id=5, contig_count=0, avg_contig_coverage=0.0)
+        )
+        db.session.add(TaxonomicAssignment(assembly_id=5, tool="sylph"))
+        db.session.commit()
+
+    resp = client.get("/isolate-stats")
+    assert resp.status_code == 200
+
+    resp = client.get("/api/isolate_stats?bins=3&scale=log")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["groups"] == ["Escherichia coli", "Unknown", "Klebsiella pneumoniae"]
+    histograms = data["histograms"]
+    assert histograms["genome_size"]["edges"] == pytest.approx([10, 100, 1000, 10000])
+    # Zeros can't be placed on a log axis and are left out
+    for metric in ("contig_count", "avg_contig_coverage", "genome_size"):
+        assert histograms[metric]["counts"] == {
+            "Escherichia coli": [1, 1, 0],
+            "Unknown": [0, 0, 1],
+            "Klebsiella pneumoniae": [0, 0, 1],
+        }
+    assert data["scatter"]["total"] == 4
+    assert data["scatter"]["points"][0] == [1.0, 99.0, 1, "Escherichia coli"]
+
+    resp = client.get("/api/isolate_stats?bins=2&points=2")
+    data = resp.get_json()
+    assert data["histograms"]["avg_contig_coverage"]["counts"] == {
+        "Escherichia coli": [1, 1],
+        "Unknown": [1, 1],
+        "Klebsiella pneumoniae": [0, 1],
+    }
+    assert len(data["scatter"]["points"]) == 2
+    assert data["scatter"]["total"] == 4
+
+
+def test_query_time_budget(client, monkeypatch):
+    from app.app import app
+
+    runaway = (
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+        "SELECT x FROM c"
+    )
+    for endpoint in ["api_query", "api", "download"]:
+        monkeypatch.setitem(app.config["QUERY_TIMEOUTS"], endpoint, 0.05)
+
+    resp = client.post("/api/query", data={"query": runaway})
+    assert resp.status_code == 504
+    assert "time limit" in resp.get_json()["error"]
+
+    resp = client.post("/api", data={"query": runaway})
+    assert resp.get_json()["status_code"] == 504
+
+    resp = client.post("/download", data={"query": runaway + " ORDER BY x"})
+    assert resp.status_code == 504
+
+    # The connection stays usable once the budget is cleared
+    resp = client.post("/api", data={"query": "SELECT 1 AS one"})
+    assert resp.get_json() == {"result": [{"one": 1}], "status_code": 200}
+
+
+def test_download_time_budget(client, monkeypatch):
+    from app.app import app
+
+    runaway = (
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+        "SELECT x FROM c"
+    )
+    monkeypatch.setitem(app.config["QUERY_TIMEOUTS"], "download", 0.05)
+    resp = client.post("/download", data={"query": runaway})
+    assert resp.status_code == 200
+    lines = resp.data.decode("utf-8").splitlines()
+    assert lines[0] == "x"
+    assert lines[-1].startswith("# ERROR: export cut short")
+    assert "time limit" in lines[-1]
+
+    # Time spent waiting on a slow client doesn't count against the budget
+    monkeypatch.setitem(app.config["QUERY_TIMEOUTS"], "download", 0.5)
+    finite = runaway.replace("FROM c)", "FROM c LIMIT 12000)")
+    resp = client.post("/download", data={"query": finite}, buffered=False)
+    chunks = []
+    for chunk in resp.response:
+        chunks.append(chunk)
+        time.sleep(0.3)
+    resp.close()
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    assert len(lines) == 12001
+    assert lines[-1] == "12000"
+
+
+def test_server_timing(client):
+    from app.instrumentation import latency_histograms
+
+    resp = client.get("/api/isolates?draw=1&start=0&length=10&search[value]=abc")
+    assert resp.status_code == 200
+    phases = [p.split(";")[0] for p in resp.headers["Server-Timing"].split(", ")]
+    assert phases == ["count", "filtered_count", "page", "json", "db", "total"]
+    assert latency_histograms()["api_isolates"]["count"] >= 1
+
+
+def test_metrics(client):
+    from app.cache import SharedCache
+
+    SharedCache("metrics_test").get("missing")
+    client.get("/api/isolates?draw=1&start=0&length=10")
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    body = resp.data.decode("utf-8")
+    assert (
+        'marc_http_requests_total{endpoint="api_isolates",method="GET",status="200"}'
+        in body
+    )
+    assert 'marc_sql_statements_total{endpoint="api_isolates"}' in body
+    assert "marc_sql_statement_duration_seconds_bucket" in body
+    assert 'marc_cache_lookups_total{cache="metrics_test",result="miss"}' in body
+
+
+def test_conditional_get(client, monkeypatch, tmp_path):
+    last_sync = tmp_path / "last_sync"
+    last_sync.write_text("2024-01-01")
+    monkeypatch.setenv("MARC_DB_LAST_SYNC", str(last_sync))
+
+    resp = client.get("/api/isolates?draw=1&start=0&length=10")
+    etag = resp.headers["ETag"]
+    assert resp.status_code == 200
+    assert etag.startswith('W/"')
+
+    resp = client.get(
+        "/api/isolates?draw=1&start=0&length=10", headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+    assert resp.data == b""
+
+    # Other parameters and a new sync get a different tag
+    resp = client.get(
+        "/api/isolates?draw=2&start=0&length=10", headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 200
+    last_sync.write_text("2024-02-01")
+    resp = client.get(
+        "/api/isolates?draw=1&start=0&length=10", headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 200
+
+    # Pages that are not cacheable get no tag
+    assert "ETag" not in client.get("/health").headers
+
+
+def _statement_count(resp):
+    timing = resp.headers["Server-Timing"]
+    return int(timing.split('desc="')[1].split(" statements")[0])
+
+
+def test_detail_pages_statement_count(client):
+    from app.app import db
+    from marc_db.models import (
+        Antimicrobial,
+        Assembly,
+        AssemblyQC,
+        Isolate,
+        TaxonomicAssignment,
+    )
+
+    with client.application.app_context():
+        db.session.add(Isolate(sample_id="S1"))
+        for assembly_id in (1, 2):
+            db.session.add(Assembly(id=assembly_id, isolate_id="S1"))
+        db.session.add(AssemblyQC(assembly_id=1, contig_count=10))
+        db.session.add(
+            TaxonomicAssignment(assembly_id=1, tool="sylph", classification="E. coli")
+        )
+        for idx in range(50):
+            db.session.add(Antimicrobial(assembly_id=1, gene_symbol=f"bla{idx}"))
+        db.session.commit()
+
+    resp = client.get("/isolate/S1")
+    assert resp.status_code == 200
+    assert b"/assembly/2" in resp.data
+    assert _statement_count(resp) == 1
+
+    resp = client.get("/assembly/1")
+    assert resp.status_code == 200
+    assert b"bla49" in resp.data
+    # The assembly with its QC, then one query per collection
+    assert _statement_count(resp) == 4
+
+
+def test_species_tree(client, monkeypatch, tmp_path):
+    monkeypatch.setattr("app.app.MARC_TREE_FP", str(tmp_path))
+    (tmp_path / "escherichia_coli.treefile").write_text("((S1:1,S2:1):1,S3:2);")
+
+    resp = client.get("/species/Escherichia coli")
+    assert resp.status_code == 200
+    assert b"((S1" not in resp.data
+
+    resp = client.get("/api/species/Escherichia coli/tree")
+    assert resp.data == b"((S1:1.0,S2:1.0):1.0,S3:2.0);"
+    etag = resp.headers["ETag"]
+    resp = client.get(
+        "/api/species/Escherichia coli/tree", headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+
+    resp = client.get("/api/species/Escherichia coli/tree?isolates=S1,S3&prune=true")
+    assert resp.data == b"(S1:2.0,S3:2.0);"
+    resp = client.get("/api/species/Escherichia coli/tree?isolates=S1,S2")
+    assert resp.data == b"(S1:1.0,S2:1.0):1.0;"
+    assert client.get("/api/species/Escherichia coli/tree?depth=0").status_code == 400
+    assert client.get("/api/species/Unknown/tree").status_code == 404
+
+
+def test_compact_format(client):
+    import datetime
+
+    from app.app import db
+    from marc_db.models import Isolate
+
+    with client.application.app_context():
+        for idx in range(3):
+            db.session.add(
+                Isolate(
+                    sample_id=f"S{idx}",
+                    subject_id=idx,
+                    received_date=datetime.date(2024, 1, idx + 1),
+                )
+            )
+        db.session.commit()
+
+    for url in [
+        "/api/isolates?draw=1&start=0&length=2",
+        "/api/aliquots?draw=1&start=0&length=2",
+    ]:
+        full = client.get(url).get_json()
+        compact = client.get(url + "&format=compact").get_json()
+        assert all(isinstance(row, list) for row in compact["data"])
+        assert [dict(zip(compact["columns"], r)) for r in compact["data"]] == (
+            full["data"]
+        )
+
+    query = {"query": "SELECT sample_id, received_date FROM isolates", "draw": "1"}
+    compact = client.post("/api/query", data={**query, "format": "compact"})
+    full = client.post("/api/query", data=query).get_json()
+    rows = compact.get_json()["data"]
+    assert [dict(zip(["sample_id", "received_date"], r)) for r in rows] == (
+        full["data"]
+    )
+
+
+def test_amr_prevalence(client):
+    from app.app import db
+    from marc_db.models import Antimicrobial, Assembly, Isolate, TaxonomicAssignment
+
+    with client.application.app_context():
+        collections = {"S1": "AST", "S2": "AST", "S3": None, "S4": None}
+        for idx, (sample_id, collection) in enumerate(collections.items(), 1):
+            db.session.add(Isolate(sample_id=sample_id, special_collection=collection))
+            db.session.add(Assembly(id=idx, isolate_id=sample_id))
+            db.session.add(
+                TaxonomicAssignment(
+                    assembly_id=idx, tool="sylph", classification="Escherichia coli"
+                )
+            )
+        for assembly_id in (1, 3, 3):
+            db.session.add(
+                Antimicrobial(
+                    assembly_id=assembly_id, gene_symbol="mecA", element_type="AMR"
+                )
+            )
+        db.session.commit()
+
+    resp = client.get("/api/amr/prevalence")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["columns"][:4] == [
+        "gene_symbol",
+        "element_type",
+        "species",
+        "special_collection",
+    ]
+    assert sorted(data["data"], key=lambda r: r[3] or "") == [
+        ["mecA", "AMR", "Escherichia coli", None, 1, 2, 0.5],
+        ["mecA", "AMR", "Escherichia coli", "AST", 1, 2, 0.5],
+    ]
+
+    resp = client.get("/api/amr/prevalence?by_collection=false&gene=mecA")
+    assert resp.get_json()["data"] == [
+        ["mecA", "AMR", "Escherichia coli", None, 2, 4, 0.5]
+    ]
+    resp = client.get("/api/amr/prevalence?species=Klebsiella pneumoniae")
+    assert resp.get_json()["data"] == []
+    assert client.get("/api/amr/prevalence?format=xml").status_code == 400
+
+    resp = client.get("/api/amr/prevalence?format=arrow&collection=AST")
+    assert resp.mimetype == "application/vnd.apache.arrow.stream"
+
+    resp = client.get("/species/Escherichia coli")
+    assert b"mecA" in resp.data
+    resp = client.get("/antimicrobial/1")
+    assert b"Prevalence of mecA" in resp.data
+
+
+def test_pages_wait_for_prevalence_counts(client, monkeypatch):
+    from app.app import db
+    from marc_db.models import Antimicrobial, Assembly, Isolate
+
+    with client.application.app_context():
+        db.session.add(Isolate(sample_id="S1"))
+        db.session.add(Assembly(id=1, isolate_id="S1"))
+        db.session.add(Antimicrobial(id=1, assembly_id=1, gene_symbol="mecA"))
+        db.session.commit()
+
+    monkeypatch.setattr("app.prevalence.ready_counts", lambda *args: None)
+    resp = client.get("/species/Escherichia coli")
+    assert resp.status_code == 200
+    assert b"Antimicrobial resistance genes" not in resp.data
+    resp = client.get("/antimicrobial/1")
+    assert resp.status_code == 200
+    assert b"Prevalence of mecA" not in resp.data
+
+
+def test_pending_prevalence_pages_are_not_cached(client, monkeypatch, tmp_path):
+    from app import prevalence
+    from app.app import db
+    from marc_db.models import Antimicrobial, Assembly, Isolate
+
+    last_sync = tmp_path / "last_sync"
+    last_sync.write_text("2024-01-01")
+    monkeypatch.setenv("MARC_DB_LAST_SYNC", str(last_sync))
+    with client.application.app_context():
+        db.session.add(Isolate(sample_id="S1"))
+        db.session.add(Assembly(id=1, isolate_id="S1"))
+        db.session.add(Antimicrobial(id=1, assembly_id=1, gene_symbol="mecA"))
+        db.session.commit()
+        counts = prevalence.compute_counts(db)
+
+    for path in ("/species/Escherichia coli", "/antimicrobial/1"):
+        monkeypatch.setattr("app.prevalence.ready_counts", lambda *args: None)
+        pending = client.get(path)
+        assert pending.status_code == 200
+        assert "ETag" not in pending.headers
+        assert "Last-Modified" not in pending.headers
+        assert pending.cache_control.no_store
+
+        monkeypatch.setattr("app.prevalence.ready_counts", lambda *args: counts)
+        ready = client.get(path)
+        etag = ready.headers["ETag"]
+        assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_batch_lookup(client, monkeypatch):
+    import io
+    import json
+
+    from app.app import db
+    from marc_db.models import Antimicrobial, Assembly, AssemblyQC, Isolate
+
+    monkeypatch.setattr("app.batch.CHUNK_SIZE", 2)
+    with client.application.app_context():
+        for idx in range(1, 4):
+            db.session.add(Isolate(sample_id=f"S{idx}"))
+            db.session.add(Assembly(id=idx, isolate_id=f"S{idx}"))
+        db.session.add(AssemblyQC(assembly_id=1, contig_count=10))
+        db.session.add(Antimicrobial(assembly_id=1, gene_symbol="mecA"))
+        db.session.commit()
+
+    resp = client.post("/api/batch", json={"ids": ["S3", "S1", "S9", "S1"]})
+    assert resp.status_code == 200
+    assert resp.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert [(r["id"], r["found"]) for r in records] == [
+        ("S3", True),
+        ("S1", True),
+        ("S9", False),
+    ]
+    assembly = records[1]["assemblies"][0]
+    assert assembly["assembly_qc"]["contig_count"] == 10
+    assert [a["gene_symbol"] for a in assembly["antimicrobials"]] == ["mecA"]
+    assert records[0]["assemblies"][0]["assembly_qc"] is None
+
+    resp = client.post(
+        "/api/batch",
+        data={"type": "assembly", "ids": (io.BytesIO(b"2,3\n"), "ids.txt")},
+    )
+    records = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert [r["isolate"]["sample_id"] for r in records] == ["S2", "S3"]
+
+    assert client.post("/api/batch", json={"ids": "S1"}).status_code == 400
+    assert (
+        client.post("/api/batch", json={"type": "assembly", "ids": ["x"]}).status_code
+        == 400
+    )
+    monkeypatch.setenv("MARC_BATCH_MAX_IDS", "1")
+    assert client.post("/api/batch", json={"ids": ["S1", "S2"]}).status_code == 400
@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from app import cache as cache_module
+from app.cache import SharedCache, make_key
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("MARC_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_get_or_set_computes_once(cache_dir):
+    cache = SharedCache("test")
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return {"count": 42}
+
+    assert cache.get_or_set("k", factory) == {"count": 42}
+    assert cache.get_or_set("k", factory) == {"count": 42}
+    assert len(calls) == 1
+
+
+def test_shared_between_instances(cache_dir):
+    SharedCache("test").set("k", 1)
+    assert SharedCache("test").get("k") == 1
+    assert SharedCache("other").get("k") is None
+
+
+def test_lru_eviction(cache_dir, monkeypatch):
+    monkeypatch.setattr(cache_module, "TOUCH_INTERVAL", -1)
+    cache = SharedCache("test", max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_hits_only_touch_stale_access_times(cache_dir, monkeypatch):
+    cache = SharedCache("test")
+    cache.set("k", 1)
+
+    def accessed():
+        conn = sqlite3.connect(cache_dir / "test.sqlite")
+        try:
+            return conn.execute("SELECT accessed FROM entries").fetchone()[0]
+        finally:
+            conn.close()
+
+    before = accessed()
+    assert cache.get("k") == 1
+    assert accessed() == before
+
+    monkeypatch.setattr(cache_module, "TOUCH_INTERVAL", -1)
+    assert cache.get("k") == 1
+    assert accessed() > before
+
+
+def test_add_only_stores_new_keys(cache_dir):
+    assert SharedCache("test").add("k", 1)
+    assert not SharedCache("test").add("k", 2)
+    assert SharedCache("test").get("k") == 1
+
+    expiring = SharedCache("test", ttl=-1)
+    assert expiring.add("k", 3)
+
+
+def test_ttl_expiry(cache_dir):
+    cache = SharedCache("test", ttl=-1)
+    cache.set("k", 1)
+    assert cache.get("k", "missing") == "missing"
+
+
+def test_make_key_is_stable():
+    assert make_key("a", {"x": 1, "y": 2}) == make_key("a", {"y": 2, "x": 1})
+    assert make_key("a") != make_key("b")
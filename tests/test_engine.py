@@ -0,0 +1,64 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from app.engine import database_url, engine_options, init_app
+
+
+def test_database_url_read_only(monkeypatch):
+    monkeypatch.delenv("MARC_DB_READ_ONLY", raising=False)
+    monkeypatch.delenv("MARC_DB_IMMUTABLE", raising=False)
+    assert (
+        database_url("sqlite:////data/db.sqlite")
+        == "sqlite:///file:/data/db.sqlite?mode=ro&uri=true"
+    )
+    assert database_url("sqlite:///:memory:") == "sqlite:///:memory:"
+    assert database_url("postgresql://u@host/marc") == "postgresql://u@host/marc"
+
+    monkeypatch.setenv("MARC_DB_IMMUTABLE", "true")
+    assert database_url("sqlite:////data/db.sqlite").endswith("&immutable=1")
+
+    monkeypatch.setenv("MARC_DB_READ_ONLY", "false")
+    assert database_url("sqlite:////data/db.sqlite") == "sqlite:////data/db.sqlite"
+
+
+def test_engine_options_pool():
+    assert engine_options("sqlite:///:memory:")["poolclass"] is StaticPool
+    assert engine_options("sqlite:////data/db.sqlite")["poolclass"] is QueuePool
+
+
+def _engine(url):
+    engine = create_engine(database_url(url), **engine_options(url))
+    init_app(Flask(__name__), SimpleNamespace(engine=engine))
+    return engine
+
+
+def test_file_database_is_read_only(monkeypatch, tmp_path):
+    monkeypatch.delenv("MARC_DB_READ_ONLY", raising=False)
+    db_fp = tmp_path / "db.sqlite"
+    with sqlite3.connect(db_fp) as conn:
+        conn.execute("CREATE TABLE isolates (sample_id TEXT)")
+        conn.execute("INSERT INTO isolates VALUES ('S1')")
+    conn.close()
+
+    engine = _engine(f"sqlite:///{db_fp}")
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT sample_id FROM isolates")) == "S1"
+        assert conn.scalar(text("PRAGMA temp_store")) == 2
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO isolates VALUES ('S2')"))
+    engine.dispose()
+
+
+def test_memory_database_is_shared():
+    engine = _engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE isolates (sample_id TEXT)"))
+        conn.execute(text("INSERT INTO isolates VALUES ('S1')"))
+    with engine.connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM isolates")) == 1
@@ -0,0 +1,100 @@
+import datetime
+
+import pytest
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    select,
+)
+
+from app.filters import column_filter
+
+metadata = MetaData()
+assemblies = Table(
+    "assemblies",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("isolate_id", String, index=True),
+    Column("completeness", Float),
+    Column("has_nanopore", Boolean),
+    Column("run_date", Date),
+)
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            assemblies.insert(),
+            [
+                {
+                    "id": i,
+                    "isolate_id": f"S{i:03d}",
+                    "completeness": 90.0 + i,
+                    "has_nanopore": i % 2 == 0,
+                    "run_date": datetime.date(2024, 1, i),
+                }
+                for i in range(1, 11)
+            ],
+        )
+    return engine
+
+
+def ids(engine, col, value):
+    query = select(assemblies.c.id).where(column_filter(col, value))
+    with engine.connect() as conn:
+        return sorted(conn.scalars(query))
+
+
+@pytest.mark.parametrize(
+    "col,value,expected",
+    [
+        ("id", "3", [3]),
+        ("id", "=3", [3]),
+        ("id", ">=9", [9, 10]),
+        ("id", "<2", [1]),
+        ("id", "4..6", [4, 5, 6]),
+        ("id", "..2", [1, 2]),
+        ("id", "9..", [9, 10]),
+        ("id", "1, 5,7", [1, 5, 7]),
+        ("completeness", ">99.5", [10]),
+        ("completeness", "95..96", [5, 6]),
+        ("isolate_id", "s00", list(range(1, 10))),
+        ("isolate_id", "S01*", [10]),
+        ("isolate_id", "=S002", [2]),
+        ("isolate_id", "S002,S004", [2, 4]),
+        ("has_nanopore", "true", [2, 4, 6, 8, 10]),
+        ("run_date", ">=2024-01-09", [9, 10]),
+        ("id", "   ", list(range(1, 11))),
+    ],
+)
+def test_column_filter(engine, col, value, expected):
+    assert ids(engine, assemblies.c[col], value) == expected
+
+
+@pytest.mark.parametrize(
+    "col,value", [("id", ">=abc"), ("completeness", "x..y"), ("has_nanopore", "maybe")]
+)
+def test_invalid_value_matches_nothing(engine, col, value):
+    assert ids(engine, assemblies.c[col], value) == []
+
+
+def test_labelled_column(engine):
+    col = assemblies.c.isolate_id.label("sample")
+    assert ids(engine, col, "S00*") == list(range(1, 10))
+
+
+def test_uses_native_types():
+    sql = str(column_filter(assemblies.c.id, ">=5"))
+    assert "CAST" not in sql
+    sql = str(column_filter(assemblies.c.isolate_id, "S01*"))
+    assert "CAST" not in sql and "LIKE" not in sql
@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    select,
+)
+
+from app import index_advisor
+
+metadata = MetaData()
+assemblies = Table(
+    "assemblies",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("isolate_id", String),
+)
+antimicrobials = Table(
+    "antimicrobials",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("assembly_id", Integer, ForeignKey("assemblies.id")),
+    Column("gene_symbol", String),
+)
+QUERIES = {
+    "antimicrobials": (
+        select(
+            antimicrobials.c.id,
+            antimicrobials.c.gene_symbol,
+            assemblies.c.isolate_id.label("isolate_id"),
+        ).join(assemblies),
+        antimicrobials.c.id,
+    )
+}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    metadata.create_all(engine)
+    return engine
+
+
+def test_advise_reports_sorts_and_lookups(engine):
+    findings = index_advisor.advise(engine, QUERIES)
+    checks = {f["check"]: f for f in findings}
+
+    assert "sort by id" not in checks
+    assert checks["sort by gene_symbol"]["index"] == (
+        "antimicrobials",
+        ("gene_symbol", "id"),
+    )
+    assert any("TEMP B-TREE" in d for d in checks["sort by gene_symbol"]["plan"])
+    assert checks["lookup by assembly_id"]["index"] == (
+        "antimicrobials",
+        ("assembly_id",),
+    )
+
+    report = index_advisor.report(findings)
+    assert (
+        "CREATE INDEX IF NOT EXISTS ix_antimicrobials_gene_symbol_id "
+        "ON antimicrobials (gene_symbol, id)"
+    ) in report
+
+
+def test_apply_indexes(engine):
+    findings = index_advisor.advise(engine, QUERIES)
+    index_advisor.apply_indexes(engine, index_advisor.suggested_indexes(findings))
+
+    remaining = {f["check"] for f in index_advisor.advise(engine, QUERIES)}
+    assert "sort by gene_symbol" not in remaining
+    assert "lookup by assembly_id" not in remaining
+
+
+def test_suggested_indexes_drop_covered_prefixes():
+    findings = [
+        {"index": ("assemblies", ("isolate_id",))},
+        {"index": ("assemblies", ("isolate_id", "id"))},
+        {"index": None},
+    ]
+    assert index_advisor.suggested_indexes(findings) == [
+        "CREATE INDEX IF NOT EXISTS ix_assemblies_isolate_id_id "
+        "ON assemblies (isolate_id, id)"
+    ]
@@ -0,0 +1,47 @@
+import pytest
+from flask import Flask
+from marc_db.models import Antimicrobial, Assembly, TaxonomicAssignment
+
+from app import prevalence
+from app.cache import make_key
+
+
+@pytest.fixture
+def metadata():
+    return Assembly.metadata
+
+
+@pytest.fixture
+def database(database, monkeypatch):
+    monkeypatch.setattr(prevalence, "get_db_sync_marker", lambda: "sync-1")
+    database.session.add(Assembly(id=1))
+    database.session.add(
+        TaxonomicAssignment(assembly_id=1, tool="sylph", classification="E. coli")
+    )
+    database.session.add(Antimicrobial(assembly_id=1, gene_symbol="mecA"))
+    database.session.commit()
+    return database
+
+
+def _wait_for_build():
+    assert prevalence._building.acquire(timeout=5)
+    prevalence._building.release()
+
+
+def test_counts_are_built_in_background(database):
+    app = Flask(__name__)
+    assert prevalence.ready_counts(app, database) is None
+    _wait_for_build()
+    assert prevalence.ready_counts(app, database) == {
+        "totals": [["E. coli", None, 1]],
+        "genes": [["mecA", None, "E. coli", None, 1]],
+    }
+
+
+def test_one_worker_builds_the_counts(database):
+    # Another worker has already claimed the build for this sync
+    assert prevalence._build_claims.add(make_key("sync-1", "sylph"), 0)
+    app = Flask(__name__)
+    assert prevalence.ready_counts(app, database) is None
+    _wait_for_build()
+    assert prevalence.ready_counts(app, database) is None
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import text
+
+from app import results
+
+
+@pytest.fixture
+def database(database):
+    with database.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE isolates (sample_id TEXT, subject_id INT)"))
+        conn.execute(
+            text("INSERT INTO isolates VALUES ('S1', 1), ('S2', 2), ('S3', 2)")
+        )
+    results.init_app(database)
+    return database
+
+
+def _materialized(database):
+    conn = results._connect()
+    try:
+        return dict(conn.execute("SELECT name, row_count FROM result_meta"))
+    finally:
+        conn.close()
+
+
+def test_cached_query_materializes_once(database):
+    sql = "SELECT subject_id, COUNT(*) AS n FROM isolates GROUP BY subject_id;"
+    cached = results.cached_query(database, sql)
+    assert cached.startswith(f"SELECT * FROM {results.SCHEMA}.r_")
+    assert list(_materialized(database).values()) == [2]
+
+    # Whitespace differences share the materialized result
+    assert results.cached_query(database, "  " + sql.replace(" ", "\n")) == cached
+
+    with database.engine.connect() as conn:
+        rows = conn.execute(text(cached + " ORDER BY subject_id")).all()
+    assert [tuple(r) for r in rows] == [(1, 1), (2, 2)]
+
+
+def test_cached_query_keeps_whitespace_in_literals(database):
+    spaced = results.cached_query(database, "SELECT 'a    b' AS s, 'c\nd' AS t")
+    single = results.cached_query(database, "SELECT 'a b' AS s, 'c\nd' AS t")
+    assert spaced != single
+
+    with database.engine.connect() as conn:
+        assert tuple(conn.execute(text(spaced)).one()) == ("a    b", "c\nd")
+        assert tuple(conn.execute(text(single)).one()) == ("a b", "c\nd")
+
+
+def test_cached_query_keeps_comments_apart(database):
+    filtered = results.cached_query(
+        database, "SELECT sample_id FROM isolates -- only S1\nWHERE sample_id = 'S1'"
+    )
+    commented = results.cached_query(
+        database, "SELECT sample_id FROM isolates -- only S1 WHERE sample_id = 'S1'"
+    )
+    assert filtered != commented
+
+    with database.engine.connect() as conn:
+        assert len(conn.execute(text(filtered)).all()) == 1
+        assert len(conn.execute(text(commented)).all()) == 3
+    assert results.normalize_sql("SELECT /* a  b */  1") == "SELECT /* a  b */ 1"
+
+
+def test_cached_query_skips_unusable_results(database, monkeypatch):
+    assert results.cached_query(database, "SELECT nonsense FROM nowhere") is None
+
+    monkeypatch.setenv("MARC_RESULT_CACHE_MAX_ROWS", "2")
+    assert results.cached_query(database, "SELECT * FROM isolates") is None
+    assert list(_materialized(database).values()) == [results.OVERSIZED]
+
+    # An oversized result is remembered rather than run again
+    def materialize(*args):
+        raise AssertionError("oversized result materialized again")
+
+    monkeypatch.setattr(results, "_materialize", materialize)
+    assert results.cached_query(database, "SELECT * FROM isolates") is None
+
+
+def test_cached_query_evicts_least_recently_used(database, monkeypatch):
+    monkeypatch.setenv("MARC_RESULT_CACHE_TOTAL_ROWS", "4")
+    first = results.cached_query(database, "SELECT * FROM isolates")
+    second = results.cached_query(database, "SELECT sample_id FROM isolates")
+    assert first != second
+    assert list(_materialized(database)) == [second.rsplit(".", 1)[1]]
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+
+from app import search
+
+
+@pytest.fixture
+def engine(database):
+    search.init_app(database)
+    return database.engine
+
+
+@pytest.fixture
+def isolates(engine):
+    metadata = MetaData()
+    isolates = Table(
+        "isolates",
+        metadata,
+        Column("sample_id", String, primary_key=True),
+        Column("suspected_organism", String),
+        Column("subject_id", Integer),
+    )
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            isolates.insert(),
+            [
+                {
+                    "sample_id": "S1",
+                    "suspected_organism": "Escherichia coli",
+                    "subject_id": 1,
+                },
+                {
+                    "sample_id": "S2",
+                    "suspected_organism": "Staphylococcus aureus",
+                    "subject_id": 2,
+                },
+                {"sample_id": "S3", "suspected_organism": None, "subject_id": 1234},
+            ],
+        )
+    return isolates
+
+
+def _search(engine, isolates, term):
+    query = select(isolates)
+    condition = search.match_filter(
+        SimpleNamespace(engine=engine), "isolates", query, isolates.c.sample_id, term
+    )
+    if condition is None:
+        return None
+    with engine.connect() as conn:
+        return sorted(conn.execute(query.where(condition)).scalars())
+
+
+def test_match_filter_uses_built_index(engine, isolates, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(search, "_schedule_build", lambda *args: scheduled.append(args))
+
+    # Nothing is indexed yet, so callers fall back to LIKE while it builds
+    assert _search(engine, isolates, "coli") is None
+    assert len(scheduled) == 1
+
+    search.build_index(engine, "isolates", select(isolates), isolates.c.sample_id)
+
+    assert _search(engine, isolates, "COLI") == ["S1"]
+    assert _search(engine, isolates, "ococcus au") == ["S2"]
+    assert _search(engine, isolates, "234") == ["S3"]
+    assert _search(engine, isolates, 'a"b') == []
+    # Shorter than a trigram
+    assert _search(engine, isolates, "S1") is None
@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy import create_engine, literal, select
+
+from app.stats import _bin_case, _bin_edges
+
+
+def _bins(values, edges):
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        return [conn.scalar(select(_bin_case(literal(v), edges))) for v in values]
+
+
+def test_linear_bins():
+    edges = _bin_edges(0, 100, 4, "linear")
+    assert edges == [0, 25, 50, 75, 100]
+    assert _bins((0, 24.9, 25, 99, 100), edges) == [0, 0, 1, 3, 3]
+
+
+def test_log_bins():
+    edges = _bin_edges(1, 10000, 4, "log")
+    assert edges == pytest.approx([1, 10, 100, 1000, 10000])
+    assert _bins((1, 5, 50, 5000, 10000), edges) == [0, 0, 1, 3, 3]
+
+
+def test_single_value_bins():
+    edges = _bin_edges(7, 7, 3, "linear")
+    assert _bins((7,), edges) == [0]
+    assert _bins((7,), _bin_edges(1, 9, 1, "linear")) == [0]
+    assert _bin_edges(None, None, 3, "linear") is None
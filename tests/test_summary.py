@@ -0,0 +1,81 @@
+import pytest
+from flask import Flask
+from marc_db.models import Isolate
+
+from app import summary
+
+
+@pytest.fixture
+def metadata():
+    return Isolate.metadata
+
+
+@pytest.fixture
+def database(database):
+    database.session.add(Isolate(sample_id="S1", subject_id=1))
+    database.session.commit()
+    return database
+
+
+@pytest.fixture
+def marker(monkeypatch):
+    current = {"marker": "sync-1"}
+    monkeypatch.setattr(summary, "get_db_sync_marker", lambda: current["marker"])
+    return current
+
+
+def _add_isolate(database, sample_id):
+    database.session.add(Isolate(sample_id=sample_id, subject_id=2))
+    database.session.commit()
+
+
+def _wait_for_refresh():
+    assert summary._refreshing.acquire(timeout=5)
+    summary._refreshing.release()
+
+
+def test_snapshot_is_cached_per_sync(database, marker):
+    app = Flask(__name__)
+    assert summary.get_summary(app, database)["isolate_count"] == 1
+
+    _add_isolate(database, "S2")
+    assert summary.get_summary(app, database)["isolate_count"] == 1
+
+
+def test_new_sync_refreshes_in_background(database, marker):
+    app = Flask(__name__)
+    summary.get_summary(app, database)
+    _add_isolate(database, "S2")
+
+    marker["marker"] = "sync-2"
+    # The previous snapshot is served while the new one is computed
+    assert summary.get_summary(app, database)["isolate_count"] == 1
+    _wait_for_refresh()
+    assert summary.get_summary(app, database) == {
+        "isolate_count": 2,
+        "patient_count": 2,
+        "special_collections": [],
+        "species": [],
+    }
+
+
+def test_failed_refresh_keeps_previous_snapshot(database, marker, monkeypatch):
+    app = Flask(__name__)
+    summary.get_summary(app, database)
+
+    def fail(_database):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(summary, "compute_summary", fail)
+    marker["marker"] = "sync-2"
+    assert summary.get_summary(app, database)["isolate_count"] == 1
+    _wait_for_refresh()
+    assert summary.get_summary(app, database)["isolate_count"] == 1
+
+
+def test_no_marker_computes_directly(database, marker):
+    marker["marker"] = None
+    app = Flask(__name__)
+    assert summary.get_summary(app, database)["isolate_count"] == 1
+    _add_isolate(database, "S2")
+    assert summary.get_summary(app, database)["isolate_count"] == 2
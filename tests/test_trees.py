@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from app import trees
+
+NEWICK = "((A:1,B:2)90:0.5,(C:1,'D d':1):1,E:3);"
+
+
+def test_round_trip():
+    tree = trees.parse_newick(NEWICK)
+    assert trees.leaf_names(tree) == ["A", "B", "C", "D d", "E"]
+    assert trees.to_newick(tree) == "((A:1.0,B:2.0)90:0.5,(C:1.0,'D d':1.0):1.0,E:3.0);"
+    assert trees.to_newick(trees.parse_newick(trees.to_newick(tree))) == (
+        trees.to_newick(tree)
+    )
+
+
+def test_parse_deep_tree():
+    depth = 5000
+    newick = "(" * depth + "A" + ",B)" * depth + ";"
+    tree = trees.parse_newick(newick)
+    assert len(trees.leaf_names(tree)) == depth + 1
+    assert trees.to_newick(tree) == newick
+
+
+@pytest.mark.parametrize("newick", ["((A,B);", "(A,B));", "(A:x,B);", "('A,B);"])
+def test_parse_malformed(newick):
+    with pytest.raises(ValueError):
+        trees.parse_newick(newick)
+
+
+def test_subtree():
+    tree = trees.parse_newick(NEWICK)
+    assert trees.to_newick(trees.subtree(tree, ["A", "B"])) == "(A:1.0,B:2.0)90:0.5;"
+    assert trees.subtree(tree, ["A", "C"]) is tree
+    assert trees.subtree(tree, ["Z"]) is None
+
+
+def test_prune():
+    tree = trees.parse_newick(NEWICK)
+    assert trees.to_newick(trees.prune(tree, ["A", "C", "Z"])) == "(A:1.5,C:2.0);"
+    assert trees.prune(tree, ["Z"]) is None
+    # The cached tree is left untouched
+    assert trees.leaf_names(tree) == ["A", "B", "C", "D d", "E"]
+
+
+def test_collapse():
+    tree = trees.parse_newick(NEWICK)
+    assert trees.to_newick(trees.collapse(tree, 1)) == (
+        "('90 (2 leaves)':0.5,'2 leaves':1.0,E:3.0);"
+    )
+
+
+def test_load_tree_cached_until_modified(tmp_path):
+    path = tmp_path / "tree.treefile"
+    path.write_text("(A,B);")
+    tree = trees.load_tree(path)
+    assert trees.load_tree(path) is tree
+
+    path.write_text("(A,B,C);")
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+    assert trees.leaf_names(trees.load_tree(path)) == ["A", "B", "C"]